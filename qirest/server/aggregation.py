@@ -0,0 +1,155 @@
+"""
+The qirest cohort modeling parameter summary.
+
+The :const:`SUMMARY_URL` endpoint summarizes the session modeling
+parameter average intensities by collection and by collection
+and session number, e.g.::
+
+    curl 'http://localhost:5000/modeling-summary?project=QIN_Test'
+
+The response consists of the ``collections`` and ``sessions``
+summary lists. Each summary item has the ``collection``,
+``parameter``, ``count``, ``mean``, ``min``, ``max`` and
+``percentiles`` fields. A ``sessions`` item also has the one-based
+``session`` number. The sorted values of each collection, session
+and parameter are collected by one MongoDB aggregation, so the
+subject encounters are unwound once per request. The session
+statistics are computed from these groups, and the collection
+statistics from the merged session groups.
+
+:Note: a percentile is the nearest lower rank value. The values
+    of each session group are collected in the aggregation, which
+    limits a group to roughly one million values.
+"""
+
+import heapq
+from bson import SON
+from flask import request
+from eve.render import send_response
+from qirest_client.model.subject import Subject
+
+SUMMARY_URL = '/modeling-summary'
+"""The modeling parameter summary endpoint."""
+
+MODELING_PARAMETERS = ['fxl_k_trans', 'fxr_k_trans', 'delta_k_trans', 'v_e',
+                       'tau_i']
+"""The summarized modeling result parameters."""
+
+PERCENTILES = [5, 25, 50, 75, 95]
+"""The summary percentiles."""
+
+FILTER_PARAMS = ['project', 'collection']
+"""The request parameters which restrict the summarized subjects."""
+
+
+def register(app):
+    """
+    Adds the :const:`SUMMARY_URL` endpoint to the given Eve
+    application.
+
+    :param app: the Eve application
+    """
+    app.add_url_rule(SUMMARY_URL, 'modeling_summary',
+                     view_func=_modeling_summary, methods=['GET'])
+
+
+def modeling_summary(**query):
+    """
+    :param query: the optional :const:`FILTER_PARAMS` values
+    :return: the {collections, sessions} summary dictionary
+    """
+    match = {k: v for k, v in query.iteritems() if k in FILTER_PARAMS}
+    groups = _session_values(Subject._get_collection(), match)
+    by_session = [_summarize(values, collection=coll, session=sess,
+                             parameter=param)
+                  for (coll, sess, param), values in groups]
+    # The {(collection, parameter): session values lists} dictionary.
+    coll_values = {}
+    for (coll, _, param), values in groups:
+        coll_values.setdefault((coll, param), []).append(values)
+    by_collection = [_summarize(list(heapq.merge(*value_lists)),
+                                collection=coll, parameter=param)
+                     for (coll, param), value_lists
+                     in sorted(coll_values.iteritems())]
+
+    return dict(collections=by_collection, sessions=by_session)
+
+
+def _modeling_summary():
+    """The :const:`SUMMARY_URL` endpoint view."""
+    query = {k: request.args[k] for k in FILTER_PARAMS if k in request.args}
+
+    return send_response(None, (modeling_summary(**query),))
+
+
+def _value_pipeline(match):
+    """
+    :param match: the subject filter
+    :return: the aggregation stages which produce one
+        {collection, session, parameter, value} document per
+        session modeling parameter
+    """
+    # A session is an encounter with a session detail reference.
+    # The session number is the one-based session position.
+    is_session = {'$gt': ['$$enc.detail', None]}
+    sessions = {'$filter': {'input': '$encounters', 'as': 'enc',
+                            'cond': is_session}}
+    values = [
+        {'parameter': {'$literal': param},
+         'value': '$result.%s.image.metadata.average_intensity' % param}
+        for param in MODELING_PARAMETERS
+    ]
+
+    return [
+        {'$match': match},
+        {'$project': {'collection': 1, 'sessions': sessions}},
+        {'$unwind': {'path': '$sessions', 'includeArrayIndex': 'index'}},
+        {'$unwind': '$sessions.modelings'},
+        {'$project': {'collection': 1,
+                      'session': {'$add': ['$index', 1]},
+                      'result': '$sessions.modelings.result'}},
+        {'$project': {'collection': 1, 'session': 1, 'values': values}},
+        {'$unwind': '$values'},
+        {'$match': {'values.value': {'$ne': None}}},
+        {'$project': {'collection': 1, 'session': 1,
+                      'parameter': '$values.parameter',
+                      'value': '$values.value'}}
+    ]
+
+
+def _session_values(collection, match):
+    """
+    :param collection: the subject pymongo collection
+    :param match: the subject filter
+    :return: the ((collection, session, parameter), sorted values)
+        list in key order
+    """
+    fields = ['collection', 'session', 'parameter']
+    key = SON([(field, '$' + field) for field in fields])
+    pipeline = _value_pipeline(match) + [
+        # Sort first, so that the grouped values are in order.
+        {'$sort': {'value': 1}},
+        {'$group': {'_id': key, 'values': {'$push': '$value'}}},
+        {'$sort': SON([('_id.' + field, 1) for field in fields])}
+    ]
+    # The cursor option returns a CommandCursor rather than the raw
+    # command reply, which MongoDB 3.6 and later require.
+    cursor = collection.aggregate(pipeline, allowDiskUse=True, cursor={})
+
+    return [(tuple(doc['_id'][field] for field in fields), doc['values'])
+            for doc in cursor]
+
+
+def _summarize(values, **key):
+    """
+    :param values: the sorted summary group values
+    :param key: the summary group {field: value} items
+    :return: the summary item
+    """
+    count = len(values)
+    last = count - 1
+    percentiles = {str(pct): values[int(pct / 100.0 * last)]
+                   for pct in PERCENTILES}
+
+    return dict(key, count=count, mean=float(sum(values)) / count,
+                min=values[0], max=values[-1], percentiles=percentiles)
@@ -0,0 +1,275 @@
+"""
+The qirest Eve MongoEngine data layer extensions.
+"""
+
+import json
+import base64
+from bson import json_util
+from flask import (abort, request)
+from werkzeug.urls import url_encode
+from eve.utils import (config, debug_error_message)
+from eve_mongoengine import EveMongoengine
+from eve_mongoengine.datalayer import (MongoengineDataLayer, PymongoQuerySet)
+
+
+PAGE_PARAMS = ['max_results', 'cursor']
+"""The keyset pagination request parameters."""
+
+
+class KeysetPage(object):
+    """
+    A keyset (a.k.a. seek) pagination result page.
+
+    The page fetches one document more than the page size. The
+    extra document is not returned, but signals that there is a
+    next page. The last returned document key values make up the
+    opaque :attr:`next` cursor token.
+    """
+
+    def __init__(self, queryset, keyset, limit):
+        """
+        :param queryset: the filtered and keyset-ordered MongoEngine
+            query set
+        :param keyset: the ordered key field names
+        :param limit: the page size
+        """
+        self._queryset = queryset
+        self.keyset = keyset
+        self.limit = limit
+        self._docs = None
+        self.next = None
+        """The next page cursor token, or None if this is the last page."""
+
+    def __iter__(self):
+        return iter(self._fetch())
+
+    def count(self, with_limit_and_skip=True):
+        """
+        :return: the number of documents in this page
+        :Note: unlike a paged Eve query, this is not the total match
+            count, since counting all matches is the very cost that
+            keyset pagination avoids. Eve calls this method several
+            times per request, so the count is the fetched page
+            length rather than a database count.
+        """
+        return len(self._fetch())
+
+    def _fetch(self):
+        """
+        :return: the page documents, which are fetched in one query
+            on first use
+        """
+        if self._docs is None:
+            docs = list(PymongoQuerySet(self._queryset.limit(self.limit + 1)))
+            if len(docs) > self.limit:
+                last = docs[self.limit - 1]
+                self.next = encode_cursor([last.get(key)
+                                           for key in self.keyset])
+            self._docs = docs[:self.limit]
+
+        return self._docs
+
+    def extra(self, response):
+        """
+        Adds the page size and next cursor token to the Eve response.
+        Eve calls this method after the response items are built.
+
+        :param response: the Eve GET response dictionary
+        """
+        meta = response.setdefault(config.META, {})
+        meta['max_results'] = self.limit
+        if self.next:
+            meta['next'] = self.next
+            links = response.get(config.LINKS)
+            if links is not None:
+                href = "%s?%s" % (links['self']['href'],
+                                  next_page_query(self.limit, self.next))
+                links['next'] = dict(title='next page', href=href)
+
+
+class DataLayer(MongoengineDataLayer):
+    """
+    The qirest data layer adds opt-in keyset pagination to the
+    resources which declare a ``keyset`` setting. Keyset pagination
+    is triggered by the ``max_results`` or ``cursor`` request
+    parameter, e.g.::
+
+        GET /subject?max_results=50
+        GET /subject?max_results=50&cursor=<next>
+
+    where *next* is the response ``_meta`` item of the same name.
+    Each page is fetched by a range query on the keyset index, so
+    the cost of fetching a page does not depend on its position.
+    A request without these parameters returns all matching
+    documents, as before.
+    """
+
+    def find(self, resource, req, sub_resource_lookup):
+        keyset = config.DOMAIN[resource].get('keyset')
+        args = request.args
+        if not keyset or not ('cursor' in args or 'max_results' in args):
+            cursor = super(DataLayer, self).find(resource, req,
+                                                 sub_resource_lookup)
+            # The documents are read once, by Eve or by the collection
+            # streaming. A MongoEngine query set would otherwise cache
+            # every fetched document for the life of the request.
+            return PymongoQuerySet(cursor.no_cache())
+        if req.sort:
+            abort(400, description=debug_error_message(
+                'The sort parameter cannot be combined with a cursor'
+            ))
+        # The page size.
+        limit = req.max_results or config.KEYSET_PAGINATION_DEFAULT
+        limit = min(limit, config.KEYSET_PAGINATION_LIMIT)
+        # The next cursor token is made from the key values, so a client
+        # projection cannot omit the keys.
+        req.projection = _keyset_projection(req.projection, keyset)
+        # Delegate to the superclass for the unlimited filtered query.
+        req.max_results = 0
+        req.page = 1
+        cursor = super(DataLayer, self).find(resource, req,
+                                             sub_resource_lookup)
+        token = args.get('cursor')
+        if token:
+            values = parse_cursor(token, keyset)
+            qs = cursor.filter(__raw__=keyset_after(keyset, values))
+        else:
+            qs = cursor.filter()
+        # The MongoEngine order_by fields.
+        model = self.cls_map[resource]
+        rev_map = model._reverse_db_field_map
+        qs = qs.order_by(*[rev_map.get(key, key) for key in keyset])
+
+        return KeysetPage(qs, keyset, limit)
+
+    def find_in(self, resource, ids):
+        """
+        Fetches the documents with the given ids in one query.
+
+        :param resource: the Eve resource name
+        :param ids: the document ids
+        :return: the {id: raw document} dictionary
+        """
+        collection = self.cls_map[resource]._get_collection()
+        docs = collection.find({'_id': {'$in': list(ids)}})
+
+        return {doc['_id']: doc for doc in docs}
+
+
+class MongoengineExtension(EveMongoengine):
+    """The Eve MongoEngine extension with the qirest :class:`DataLayer`."""
+
+    datalayer_class = DataLayer
+
+
+def _keyset_projection(projection, keyset):
+    """
+    :param projection: the client projection JSON string, or None
+    :param keyset: the ordered key field names
+    :return: the projection JSON string which includes the keys
+    """
+    if not projection:
+        return projection
+    try:
+        fields = json.loads(projection)
+    except ValueError:
+        # Eve reports the invalid projection.
+        return projection
+    if not isinstance(fields, dict) or not fields:
+        return projection
+    if 0 in fields.values():
+        # An exclusion projection. Do not exclude the keys.
+        for key in keyset:
+            fields.pop(key, None)
+        if not fields:
+            return None
+    else:
+        # An inclusion projection. Include the keys.
+        for key in keyset:
+            fields[key] = 1
+
+    return json.dumps(fields)
+
+
+def next_page_query(limit, token):
+    """
+    Makes the next page query string from the current request
+    parameters, e.g. the ``where`` filter, with the given page size
+    and cursor.
+
+    :param limit: the page size
+    :param token: the next page cursor token
+    :return: the next page query string
+    """
+    args = [(name, value) for name, value in request.args.iteritems(multi=True)
+            if name not in PAGE_PARAMS]
+    args.extend([('max_results', limit), ('cursor', token)])
+
+    return url_encode(args, sort=False)
+
+
+def keyset_after(keyset, values):
+    """
+    Makes the Mongo query condition which selects the documents
+    which sort strictly after the given key values, e.g. for keyset
+    ``[a, b]`` and values ``[x, y]`` the condition is::
+
+        {'$or': [{a: {'$gt': x}}, {a: x, b: {'$gt': y}}]}
+
+    :param keyset: the ordered key field names
+    :param values: the corresponding key values
+    :return: the Mongo query condition dictionary
+    """
+    disjuncts = []
+    for i, key in enumerate(keyset):
+        cond = {k: v for k, v in zip(keyset[:i], values[:i])}
+        cond[key] = {'$gt': values[i]}
+        disjuncts.append(cond)
+
+    return {'$or': disjuncts}
+
+
+def encode_cursor(values):
+    """
+    :param values: the key values
+    :return: the opaque URL-safe cursor token
+    """
+    content = json_util.dumps(values).encode('utf-8')
+
+    return base64.urlsafe_b64encode(content).decode('ascii')
+
+
+def parse_cursor(token, keyset):
+    """
+    :param token: the ``cursor`` request parameter value
+    :param keyset: the ordered key field names
+    :return: the key values
+    :raise HTTPException: the 400 error if the token is invalid
+    """
+    try:
+        values = decode_cursor(token)
+    except (TypeError, ValueError):
+        values = None
+    if values is None or len(values) != len(keyset):
+        abort(400, description=debug_error_message(
+            'The cursor parameter is invalid'
+        ))
+
+    return values
+
+
+def decode_cursor(token):
+    """
+    :param token: the :meth:`encode_cursor` token
+    :return: the key values
+    :raise ValueError: if the token is malformed
+    """
+    try:
+        content = base64.urlsafe_b64decode(str(token))
+    except Exception:
+        raise ValueError("The cursor token is malformed: %s" % token)
+    values = json_util.loads(content.decode('utf-8'))
+    if not isinstance(values, list):
+        raise ValueError("The cursor token is malformed: %s" % token)
+
+    return values
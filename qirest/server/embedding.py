@@ -0,0 +1,88 @@
+"""
+The qirest subject session detail embedding.
+
+A subject session refers to a separately stored session detail.
+Eve only embeds a top-level reference field, so the nested session
+``detail`` reference is embedded by the event hooks below instead.
+A subject GET request with the ``embedded`` parameter ``detail``
+item, e.g.::
+
+    curl 'http://localhost:5000/subject?embedded={"detail":1}'
+
+replaces each session detail reference in the response with the
+referenced session detail document. All of the referenced session
+details are fetched in a single query per response.
+"""
+
+import json
+from flask import (request, current_app as app)
+from eve.utils import config
+
+SUBJECT_RESOURCE = 'subject'
+"""The subject Eve resource name."""
+
+SESSION_DETAIL_RESOURCE = 'sessiondetail'
+"""The session detail Eve resource name."""
+
+DETAIL_FIELDS = ['detail', 'encounters.detail']
+"""The ``embedded`` parameter items which embed the session detail."""
+
+
+def register(app):
+    """
+    Enables session detail embedding on the given Eve application.
+
+    :param app: the Eve application
+    """
+    resource_event = getattr(app, 'on_fetched_resource_' + SUBJECT_RESOURCE)
+    resource_event += _embed_resource_details
+    item_event = getattr(app, 'on_fetched_item_' + SUBJECT_RESOURCE)
+    item_event += _embed_item_details
+
+
+def is_detail_embedded():
+    """
+    :return: whether the current request ``embedded`` parameter
+        includes a :const:`DETAIL_FIELDS` item
+    """
+    embedded = request.args.get('embedded')
+    if not embedded:
+        return False
+    # Eve validates the parameter before the fetched event is raised.
+    try:
+        fields = json.loads(embedded)
+    except ValueError:
+        return False
+    if not isinstance(fields, dict):
+        return False
+
+    return any(fields.get(field) == 1 for field in DETAIL_FIELDS)
+
+
+def embed_session_details(subjects):
+    """
+    Replaces the session detail references in the given raw subject
+    documents with the referenced session detail documents.
+
+    :param subjects: the subject documents
+    """
+    sessions = [enc for sbj in subjects for enc in sbj.get('encounters', [])
+                if enc.get('detail')]
+    if not sessions:
+        return
+    ids = set(sess['detail'] for sess in sessions)
+    details = app.data.find_in(SESSION_DETAIL_RESOURCE, ids)
+    for sess in sessions:
+        detail = details.get(sess['detail'])
+        if detail:
+            sess['detail'] = detail
+
+
+def _embed_resource_details(response):
+    if is_detail_embedded():
+        embed_session_details(response.get(config.ITEMS, []))
+
+
+def _embed_item_details(response):
+    if is_detail_embedded():
+        embed_session_details([response])
@@ -0,0 +1,399 @@
+"""
+The qirest subject encounter sub-resource.
+
+A new encounter is added to a subject without rewriting the subject
+``encounters`` list. A POST request to :const:`ENCOUNTERS_URL`
+inserts the encounter in the request body, e.g.::
+
+    curl -X POST -H 'Content-Type: application/json' \\
+         -d '{"_cls": "Encounter.Session", "date": ..., "detail": ...}' \\
+         http://localhost:5000/subject/<subject id>/encounters
+
+The subject encounters are in temporal order, so the encounter is
+inserted at the position which follows the encounters on or before
+its date. Only the encounter dates are read to find that position.
+The insert is a ``$push`` at that ``$position``, which leaves the
+other encounters in place. The insert is conditional on the list
+size, so that a concurrent insert is detected and the position is
+recomputed.
+
+A PATCH request to :const:`ENCOUNTERS_URL` sets the request body
+fields of the encounter with the body ``_cls`` and ``date``, e.g.::
+
+    curl -X PATCH -H 'Content-Type: application/json' \\
+         -d '{"_cls": "Encounter.Session", "date": ..., "weight": 62}' \\
+         http://localhost:5000/subject/<subject id>/encounters
+
+The encounter class and date identify the encounter independently
+of its list position, so a concurrent insert does not redirect the
+patch. The encounter date cannot be patched. A patch body field with
+a null value is removed. The patch is a single positional ``$set``
+update.
+
+Each request only sends the changed encounter content. Both
+requests are authorized and rate limited as an Eve ``subject`` item
+PATCH request, and the subject ``item_methods`` must allow PATCH.
+The Eve ``on_pre_POST`` or ``on_pre_PATCH`` events are raised with
+the subject ``_id`` lookup. The Eve subject update events are raised
+before the write and the updated events after it, with the updated
+{field path: value} dictionary, e.g. ``{"encounters.3": {...}}``
+for an insert at position 3 or ``{"encounters.$.weight": 62}``
+for a patch, where ``encounters.$`` is the matched encounter. An
+insert which is retried after a concurrent insert raises the update
+events again with the recomputed position.
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+import pytz
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoengine.base import get_document
+from mongoengine.errors import (ValidationError, FieldDoesNotExist,
+                                NotRegistered)
+from flask import (current_app as app, abort)
+from eve.auth import requires_auth
+from eve.utils import config
+from eve.methods.common import (parse, payload, ratelimit, pre_event)
+from eve.render import send_response
+from qirest_client.model.common import Encounter
+from qirest_client.model.subject import Subject
+from qirest.server.ingest import (PayloadError, require_method)
+
+SUBJECT_RESOURCE = 'subject'
+"""The subject Eve resource name."""
+
+ENCOUNTERS_URL = '/subject/<subject_id>/encounters'
+"""The subject encounter endpoint."""
+
+IDENTITY_FIELDS = ['_cls', 'date']
+"""The encounter fields which identify the patched encounter."""
+
+INSERT_ATTEMPTS = 5
+"""The number of insert attempts when concurrent inserts interfere."""
+
+
+class ConcurrentUpdateError(Exception):
+    """The encounter list changed during every insert attempt."""
+    pass
+
+
+def register(app):
+    """
+    Adds the :const:`ENCOUNTERS_URL` endpoint to the given Eve
+    application.
+
+    :param app: the Eve application
+    """
+    app.add_url_rule(ENCOUNTERS_URL, 'encounters', view_func=_append_view,
+                     methods=['POST'])
+    app.add_url_rule(ENCOUNTERS_URL, 'encounter_patch', view_func=_patch_view,
+                     methods=['PATCH'])
+
+
+def insert_encounter(subject_id, encounter, on_update=None):
+    """
+    Inserts the given encounter into the subject encounters in date
+    order.
+
+    :param subject_id: the subject id
+    :param encounter: the raw encounter document
+    :param on_update: the optional function which is called with the
+        {field path: value} updates before each write attempt
+    :return: the updated {field path: value} dictionary, or None if
+        there is no such subject
+    :raise ConcurrentUpdateError: if concurrent inserts interfere
+        with each of the :const:`INSERT_ATTEMPTS`
+    """
+    collection = Subject._get_collection()
+    date = _utc(encounter['date'])
+    for _ in range(INSERT_ATTEMPTS):
+        subject = collection.find_one({'_id': subject_id},
+                                      {'encounters.date': 1})
+        if not subject:
+            return None
+        dates = [_utc(enc.get('date')) for enc in subject.get('encounters', [])]
+        position = bisect_right(dates, date)
+        # The list size guard, i.e. there is an item at size - 1 but
+        # not at size.
+        size = len(dates)
+        query = {'_id': subject_id, 'encounters.%d' % size: {'$exists': False}}
+        if size:
+            query['encounters.%d' % (size - 1)] = {'$exists': True}
+        push = {'$each': [encounter], '$position': position}
+        updated = datetime.utcnow().replace(microsecond=0)
+        updates = {'encounters.%d' % position: encounter,
+                   config.LAST_UPDATED: updated}
+        if on_update:
+            on_update(updates)
+        update = {'$push': {'encounters': push},
+                  '$set': {config.LAST_UPDATED: updated}}
+        if collection.update_one(query, update).matched_count:
+            return updates
+
+    raise ConcurrentUpdateError("The subject %s encounters changed during"
+                                " each insert attempt" % subject_id)
+
+
+def patch_encounter(subject_id, cls_name, date, fields, on_update=None):
+    """
+    Sets the given fields of the subject encounter with the given
+    class and date.
+
+    :param subject_id: the subject id
+    :param cls_name: the encounter ``_cls`` value
+    :param date: the encounter date
+    :param fields: the raw encounter {field: value} dictionary,
+        where a None value removes the field
+    :param on_update: the optional function which is called with the
+        {field path: value} updates before the write
+    :return: the updated {field path: value} dictionary, or None if
+        there is no such subject encounter
+    """
+    updated = datetime.utcnow().replace(microsecond=0)
+    updates = {config.LAST_UPDATED: updated}
+    update = {'$set': {config.LAST_UPDATED: updated}}
+    for field, value in fields.iteritems():
+        path = 'encounters.$.' + field
+        updates[path] = value
+        if value is None:
+            update.setdefault('$unset', {})[path] = ''
+        else:
+            update['$set'][path] = value
+    if on_update:
+        on_update(updates)
+    match = {'_cls': cls_name, 'date': date}
+    query = {'_id': subject_id, 'encounters': {'$elemMatch': match}}
+    result = Subject._get_collection().update_one(query, update)
+    if not result.matched_count:
+        return None
+
+    return updates
+
+
+def _append_view(subject_id):
+    """
+    The :const:`ENCOUNTERS_URL` POST endpoint view.
+
+    :param subject_id: the subject id string
+    """
+    return _append(SUBJECT_RESOURCE, **{config.ID_FIELD: subject_id})
+
+
+def _patch_view(subject_id):
+    """
+    The :const:`ENCOUNTERS_URL` PATCH endpoint view.
+
+    :param subject_id: the subject id string
+    """
+    return _patch(SUBJECT_RESOURCE, **{config.ID_FIELD: subject_id})
+
+
+@ratelimit()
+@requires_auth('item')
+@pre_event
+def _append(resource, **lookup):
+    """
+    Inserts the request encounter.
+
+    :param resource: the subject Eve resource name
+    :param lookup: the subject id lookup
+    :return: the response
+    """
+    require_method(resource, 'item_methods', 'PATCH')
+    oid = _object_id(lookup[config.ID_FIELD])
+    content = _payload()
+    try:
+        cls = _encounter_class(content.get('_cls'))
+        encounter = _from_payload(cls, content)
+        encounter.validate()
+    except PayloadError as e:
+        return _failure(e.issues)
+    except (ValidationError, FieldDoesNotExist, TypeError, ValueError) as e:
+        return _failure({'validation exception': str(e)})
+    try:
+        updates = insert_encounter(oid, encounter.to_mongo(),
+                                   _update_hook(oid))
+    except ConcurrentUpdateError as e:
+        abort(409, description=str(e))
+    if not updates:
+        abort(404)
+
+    return _success(oid, updates, 201)
+
+
+@ratelimit()
+@requires_auth('item')
+@pre_event
+def _patch(resource, **lookup):
+    """
+    Patches the request encounter.
+
+    :param resource: the subject Eve resource name
+    :param lookup: the subject id lookup
+    :return: the response
+    """
+    require_method(resource, 'item_methods', 'PATCH')
+    oid = _object_id(lookup[config.ID_FIELD])
+    content = _payload()
+    try:
+        cls = _encounter_class(content.get('_cls'))
+        date, fields = _patch_fields(cls, content)
+    except PayloadError as e:
+        return _failure(e.issues)
+    except (ValidationError, FieldDoesNotExist, TypeError, ValueError) as e:
+        return _failure({'validation exception': str(e)})
+    updates = patch_encounter(oid, cls._class_name, date, fields,
+                              _update_hook(oid))
+    if not updates:
+        abort(404)
+
+    return _success(oid, updates, 200)
+
+
+def _object_id(subject_id):
+    """
+    :param subject_id: the subject id string
+    :return: the subject ObjectId
+    """
+    try:
+        return ObjectId(subject_id)
+    except (InvalidId, TypeError):
+        abort(404)
+
+
+def _payload():
+    """
+    :return: the request body dictionary
+    """
+    content = payload()
+    if not isinstance(content, dict):
+        abort(400, description="The encounter payload is not a dictionary")
+
+    return content
+
+
+def _encounter_class(cls_name):
+    """
+    :param cls_name: the encounter ``_cls`` value
+    :return: the encounter class
+    :raise PayloadError: if the value is not an encounter class name
+    """
+    if not cls_name:
+        raise PayloadError(dict(_cls="The encounter class is required"))
+    try:
+        cls = get_document(cls_name)
+    except NotRegistered:
+        cls = None
+    if not (isinstance(cls, type) and issubclass(cls, Encounter)):
+        raise PayloadError(dict(_cls="Not an encounter class: %s" % cls_name))
+
+    return cls
+
+
+def _from_payload(cls, content):
+    """
+    :param cls: the encounter class
+    :param content: the encounter payload dictionary
+    :return: the encounter object
+    """
+    # Parse the Eve date strings and ids as in a subject request.
+    parsed = parse({'encounters': [content]}, SUBJECT_RESOURCE)
+    son = dict(parsed['encounters'][0])
+    son['_cls'] = cls._class_name
+
+    return cls._from_son(son)
+
+
+def _patch_fields(cls, content):
+    """
+    :param cls: the encounter class
+    :param content: the patch payload dictionary
+    :return: the (encounter date, validated raw {db field: value}
+        dictionary) tuple
+    :raise PayloadError: if the date is missing or a field is not a
+        patchable encounter field
+    """
+    if content.get('date') is None:
+        raise PayloadError(dict(date="The encounter date is required"))
+    names = [k for k in content if k not in IDENTITY_FIELDS]
+    unknown = [k for k in names if k not in cls._fields]
+    if unknown:
+        raise PayloadError({k: "Not an encounter field" for k in unknown})
+    if not names:
+        raise PayloadError(dict(encounter="The patch has no fields"))
+    # The parsed patch values. A null value is not parsed.
+    present = {k: content[k] for k in content if content[k] is not None}
+    partial = _from_payload(cls, present)
+    date_field = cls._fields['date']
+    date_field.validate(partial.date)
+    fields = {}
+    for name in names:
+        field = cls._fields[name]
+        if content[name] is None:
+            if field.required:
+                raise PayloadError({name: "The field is required"})
+            fields[field.db_field] = None
+            continue
+        value = getattr(partial, name)
+        field.validate(value)
+        fields[field.db_field] = field.to_mongo(value)
+
+    return date_field.to_mongo(partial.date), fields
+
+
+def _update_hook(subject_id):
+    """
+    :param subject_id: the subject ObjectId
+    :return: the function which raises the Eve subject update events
+        for the given updates
+    """
+    original = {config.ID_FIELD: subject_id}
+
+    def raise_update(updates):
+        getattr(app, 'on_update')(SUBJECT_RESOURCE, updates, original)
+        getattr(app, 'on_update_%s' % SUBJECT_RESOURCE)(updates, original)
+
+    return raise_update
+
+
+def _success(subject_id, updates, code):
+    """
+    Raises the Eve subject updated events and responds with the
+    subject id.
+
+    :param subject_id: the subject ObjectId
+    :param updates: the updated {field path: value} dictionary
+    :param code: the response status code
+    :return: the response
+    """
+    original = {config.ID_FIELD: subject_id}
+    getattr(app, 'on_updated')(SUBJECT_RESOURCE, updates, original)
+    getattr(app, 'on_updated_%s' % SUBJECT_RESOURCE)(updates, original)
+    response = {config.STATUS: config.STATUS_OK, config.ID_FIELD: subject_id}
+
+    return send_response(None, (response, None, None, code))
+
+
+def _failure(issues):
+    """
+    :param issues: the {field: issue} dictionary
+    :return: the 400 response
+    """
+    response = {config.STATUS: config.STATUS_ERR, config.ISSUES: issues}
+
+    return send_response(None, (response, None, None, 400))
+
+
+def _utc(date):
+    """
+    :param date: the encounter datetime
+    :return: the naive UTC datetime, as stored in the database,
+        or datetime.min if there is no date
+    """
+    if date is None:
+        return datetime.min
+    if date.tzinfo:
+        return date.astimezone(pytz.utc).replace(tzinfo=None)
+
+    return date
@@ -0,0 +1,164 @@
+"""
+The qirest MongoDB indexes.
+
+The REST resources and the seed helper look up documents by
+secondary key, e.g. a subject by project, collection and number.
+Without the :const:`INDEXES` below, each such lookup is a
+collection scan.
+"""
+
+import pymongo
+from bson import SON
+from qirest_client.model.subject import (Project, ImagingCollection, Subject)
+from qirest_client.model.imaging import Protocol
+from qirest.server import upsert
+from qirest.server.timeline import Timeline
+
+INDEXES = [
+    (Project, [('name', pymongo.ASCENDING)], dict(unique=True)),
+    (ImagingCollection, [('project', pymongo.ASCENDING),
+                         ('name', pymongo.ASCENDING)],
+     dict(unique=True)),
+    (Subject, [('project', pymongo.ASCENDING),
+               ('collection', pymongo.ASCENDING),
+               ('number', pymongo.ASCENDING)],
+     dict(unique=True)),
+    (Subject, [('encounters.detail', pymongo.ASCENDING)], {}),
+    (Protocol, [('technique', pymongo.ASCENDING),
+                ('configuration', pymongo.ASCENDING)],
+     dict(unique=True)),
+    (Timeline, [('project', pymongo.ASCENDING),
+                ('collection', pymongo.ASCENDING),
+                ('number', pymongo.ASCENDING)],
+     dict(unique=True))
+]
+"""
+The (model class, index keys, index options) tuples. The subject
+and timeline secondary key indexes are unique, which makes them a
+total order for the subject and timeline keyset pagination. The
+subject and protocol natural key indexes are unique, so that
+concurrent upserts do not create duplicates. The embedded session
+detail reference index supports finding the subjects which
+reference a given session detail.
+"""
+
+
+class UniqueIndexError(Exception):
+    """The unique index cannot be built over duplicate keys."""
+    pass
+
+
+def create_indexes():
+    """
+    Creates the :const:`INDEXES` in the currently connected database.
+    An index which already exists is not changed, except that a
+    non-unique index created by an earlier release is replaced by
+    the unique index. The replacement first canonicalizes the stored
+    natural keys and checks for duplicates.
+
+    :return: the created or existing index names
+    :raise UniqueIndexError: if a non-unique index cannot be replaced
+        because the collection has duplicate keys
+    """
+    names = []
+    for model, keys, opts in INDEXES:
+        collection = model._get_collection()
+        if opts.get('unique'):
+            names.append(_create_unique_index(model, collection, keys, opts))
+        else:
+            names.append(collection.create_index(keys, **opts))
+
+    return names
+
+
+def missing_indexes():
+    """
+    :return: the (collection name, index keys) tuples of the
+        :const:`INDEXES` which are not in the currently connected
+        database, including a unique index which is only present
+        as a non-unique index
+    """
+    missing = []
+    existing = {}
+    for model, keys, opts in INDEXES:
+        collection = model._get_collection()
+        name = collection.name
+        if name not in existing:
+            info = collection.index_information()
+            existing[name] = [(_normalize(idx['key']), bool(idx.get('unique')))
+                              for idx in info.values()]
+        unique = bool(opts.get('unique'))
+        found = any(idx_keys == _normalize(keys) and (idx_unique or not unique)
+                    for idx_keys, idx_unique in existing[name])
+        if not found:
+            missing.append((name, keys))
+
+    return missing
+
+
+def _create_unique_index(model, collection, keys, opts):
+    """
+    Creates the given unique index. A non-unique index with the same
+    keys is replaced. MongoDB does not allow two indexes on the same
+    keys, so the duplicate keys are checked before the non-unique
+    index is dropped. If the unique build fails nonetheless, then
+    the non-unique index is restored.
+
+    :param model: the document class
+    :param collection: the pymongo collection
+    :param keys: the index (field, direction) items
+    :param opts: the index options
+    :return: the index name
+    :raise UniqueIndexError: if the collection has duplicate keys
+    """
+    info = collection.index_information()
+    same = [(name, idx) for name, idx in info.iteritems()
+            if _normalize(idx['key']) == _normalize(keys)]
+    if any(idx.get('unique') for _, idx in same):
+        return collection.create_index(keys, **opts)
+    fields = [field for field, _ in keys]
+    # Stored natural keys which only differ in the dictionary item
+    # order are duplicates. Rewrite them in the upsert key order.
+    upsert.canonicalize_keys(model, fields)
+    duplicates = _duplicate_keys(collection, fields)
+    if duplicates:
+        raise UniqueIndexError(
+            "The %s collection has duplicate (%s) keys, e.g. %s. Remove the"
+            " duplicates and rerun 'qirest db init'." %
+            (collection.name, ', '.join(fields), duplicates[0])
+        )
+    for name, _ in same:
+        collection.drop_index(name)
+    try:
+        return collection.create_index(keys, **opts)
+    except pymongo.errors.PyMongoError:
+        # A concurrent writer inserted a duplicate. Restore the index.
+        if same:
+            collection.create_index(keys)
+        raise
+
+
+def _duplicate_keys(collection, fields, limit=5):
+    """
+    :param collection: the pymongo collection
+    :param fields: the key fields
+    :param limit: the maximum number of duplicates to return
+    :return: the duplicate key dictionaries
+    """
+    key = SON((field, '$' + field) for field in fields)
+    pipeline = [
+        {'$group': {'_id': key, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$limit': limit}
+    ]
+    cursor = collection.aggregate(pipeline, allowDiskUse=True, cursor={})
+
+    return [doc['_id'] for doc in cursor]
+
+
+def _normalize(keys):
+    """
+    :param keys: the index (field, direction) items
+    :return: the comparable index key list
+    """
+    return [(field, int(direction)) for field, direction in keys]
@@ -0,0 +1,338 @@
+"""
+The qirest bulk subject ingest.
+
+The :const:`INGEST_URL` endpoint accepts a list of subjects in one
+POST request. A subject session ``detail`` value is either a session
+detail id, as in the ``subject`` resource, or an inline session
+detail document, e.g.::
+
+    [
+        {"project": "QIN", "collection": "Breast", "number": 1,
+         "encounters": [
+             {"_cls": "Session", "date": ..., "detail": {"scans": [...]}},
+             ...
+         ]},
+        ...
+    ]
+
+Each document is validated as in an Eve POST request. The inline
+session details are then inserted, the sessions are set to reference
+them and the subjects are inserted, each as an unordered bulk insert.
+A subject which fails is not inserted, nor are its session details.
+The response has a ``_status`` and either an ``_id`` or ``_issues``
+item per subject in payload order, e.g.::
+
+    {"_status": "ERR", "_items": [
+        {"_status": "OK", "_id": "..."},
+        {"_status": "ERR", "_issues": {"write": "E11000 duplicate key ..."}}
+    ]}
+
+The response status is 201 if at least one subject is inserted,
+otherwise 400.
+
+The request is authorized and rate limited as an Eve ``subject``
+POST request, and as a ``sessiondetail`` POST request as well if
+there is an inline session detail. The Eve ``on_pre_POST`` events
+are raised for the ``subject`` resource, and the ``on_insert`` and
+``on_inserted`` events are raised for the inserted session details
+and subjects.
+"""
+
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from mongoengine import ValidationError
+from flask import (current_app as app, abort)
+from eve.auth import requires_auth
+from eve.utils import config
+from eve.defaults import resolve_default_values
+from eve.methods.common import (parse, payload, ratelimit, pre_event)
+from eve.render import send_response
+from qirest_client.model.subject import Subject
+from qirest_client.model.imaging import SessionDetail
+
+INGEST_URL = '/ingest'
+"""The bulk ingest endpoint."""
+
+SUBJECT_RESOURCE = 'subject'
+"""The subject Eve resource name."""
+
+SESSION_DETAIL_RESOURCE = 'sessiondetail'
+"""The session detail Eve resource name."""
+
+BATCH_SIZE = 1000
+"""The maximum number of documents in an insert request."""
+
+
+class PayloadError(Exception):
+    """The payload document validation error."""
+
+    def __init__(self, issues):
+        """
+        :param issues: the {field: issue} dictionary
+        """
+        super(PayloadError, self).__init__(str(issues))
+        self.issues = issues
+
+
+def register(app):
+    """
+    Adds the :const:`INGEST_URL` endpoint to the given Eve application.
+
+    :param app: the Eve application
+    """
+    app.add_url_rule(INGEST_URL, 'ingest', view_func=_ingest_view,
+                     methods=['POST'])
+
+
+def require_method(resource, setting, method):
+    """
+    :param resource: the Eve resource name
+    :param setting: the resource ``resource_methods`` or
+        ``item_methods`` setting name
+    :param method: the request method
+    :raise HTTPException: the 405 error if the resource setting does
+        not allow the method
+    """
+    if method not in app.config['DOMAIN'][resource][setting]:
+        abort(405)
+
+
+def authorize(resource):
+    """
+    Authorizes the current request for the given resource as an Eve
+    collection request.
+
+    :param resource: the Eve resource name
+    :return: the authentication challenge response, or None if the
+        request is authorized
+    """
+    return requires_auth('resource')(lambda resource: None)(resource)
+
+
+def ingest(items):
+    """
+    Inserts the given subjects and their inline session details.
+
+    :param items: the subject payload dictionaries
+    :return: the per-item result dictionaries in payload order
+    """
+    limit = app.config.get('INGEST_LIMIT')
+    if limit and len(items) > limit:
+        abort(400, description="The ingest payload exceeds the %d subject"
+                               " limit" % limit)
+    date_utc = datetime.utcnow().replace(microsecond=0)
+    results = []
+    # The {item index: subject document} and {item index: details}
+    # dictionaries of the valid items.
+    subjects = {}
+    details = {}
+    for i, item in enumerate(items):
+        try:
+            details[i], subjects[i] = _prepare(item, date_utc)
+        except PayloadError as e:
+            results.append(_failure(e.issues))
+        else:
+            results.append(None)
+
+    # Insert the session details, then the subjects which reference
+    # them.
+    detail_items = [(i, doc) for i in sorted(details) for doc in details[i]]
+    if detail_items:
+        _raise_insert(SESSION_DETAIL_RESOURCE,
+                      [doc for _, doc in detail_items])
+    for i, issue in _insert(SessionDetail, detail_items).iteritems():
+        results[i] = _failure(dict(detail=issue))
+    valid = [(i, subjects[i]) for i in sorted(subjects)
+             if results[i] is None]
+    if valid:
+        _raise_insert(SUBJECT_RESOURCE, [doc for _, doc in valid])
+    for i, issue in _insert(Subject, valid).iteritems():
+        results[i] = _failure(dict(write=issue))
+
+    # Remove the session details of the failed subjects.
+    failed = [i for i in details if results[i] is not None]
+    orphans = [doc['_id'] for i in failed for doc in details[i]]
+    for start in range(0, len(orphans), BATCH_SIZE):
+        query = {'_id': {'$in': orphans[start:start + BATCH_SIZE]}}
+        SessionDetail._get_collection().delete_many(query)
+
+    inserted = [i for i in sorted(subjects) if results[i] is None]
+    for i in inserted:
+        results[i] = {config.STATUS: config.STATUS_OK,
+                      config.ID_FIELD: subjects[i]['_id']}
+    # Notify the write event listeners, e.g. the subject timeline.
+    ok_details = [doc for i in inserted for doc in details[i]]
+    if ok_details:
+        _raise_inserted(SESSION_DETAIL_RESOURCE, ok_details)
+    if inserted:
+        _raise_inserted(SUBJECT_RESOURCE, [subjects[i] for i in inserted])
+
+    return results
+
+
+def _ingest_view():
+    """The :const:`INGEST_URL` endpoint view."""
+    return _ingest(SUBJECT_RESOURCE)
+
+
+@ratelimit()
+@requires_auth('resource')
+@pre_event
+def _ingest(resource, **lookup):
+    """
+    Ingests the request subjects.
+
+    :param resource: the subject Eve resource name
+    :param lookup: the unused Eve lookup
+    :return: the response
+    """
+    require_method(resource, 'resource_methods', 'POST')
+    items = payload()
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        abort(400, description="The ingest payload is not a subject list")
+    if any(_has_inline_detail(item) for item in items):
+        require_method(SESSION_DETAIL_RESOURCE, 'resource_methods', 'POST')
+        challenge = authorize(SESSION_DETAIL_RESOURCE)
+        if challenge:
+            return challenge
+    results = ingest(items)
+    ok = [res for res in results if res[config.STATUS] == config.STATUS_OK]
+    status = config.STATUS_OK if len(ok) == len(results) else config.STATUS_ERR
+    response = {config.STATUS: status, config.ITEMS: results}
+    code = 201 if ok or not results else 400
+
+    return send_response(None, (response, None, None, code))
+
+
+def _has_inline_detail(item):
+    """
+    :param item: the subject payload item
+    :return: whether the item has an inline session detail
+    """
+    if not isinstance(item, dict):
+        return False
+    encounters = item.get('encounters')
+    if not isinstance(encounters, list):
+        return False
+
+    return any(isinstance(enc, dict) and isinstance(enc.get('detail'), dict)
+               for enc in encounters)
+
+
+def _prepare(item, date_utc):
+    """
+    Validates the given subject and its inline session details.
+
+    :param item: the subject payload dictionary
+    :param date_utc: the creation date
+    :return: the (session details, subject) raw documents
+    :raise PayloadError: if a document is invalid
+    """
+    if not isinstance(item, dict):
+        raise PayloadError(dict(subject="The item is not a dictionary"))
+    item = dict(item)
+    details = []
+    encounters = item.get('encounters') or []
+    if not isinstance(encounters, list):
+        raise PayloadError(dict(encounters="The value is not a list"))
+    item['encounters'] = encounters = [dict(enc) if isinstance(enc, dict)
+                                       else enc for enc in encounters]
+    for j, enc in enumerate(encounters):
+        if isinstance(enc, dict) and isinstance(enc.get('detail'), dict):
+            try:
+                detail = to_mongo(SESSION_DETAIL_RESOURCE, enc['detail'],
+                                  date_utc)
+            except PayloadError as e:
+                raise PayloadError({'encounters.%d.detail' % j: e.issues})
+            detail['_id'] = ObjectId()
+            details.append(detail)
+            enc['detail'] = detail['_id']
+    subject = to_mongo(SUBJECT_RESOURCE, item, date_utc)
+    subject['_id'] = ObjectId()
+
+    return details, subject
+
+
+def to_mongo(resource, value, date_utc):
+    """
+    Validates the given payload document as in an Eve POST request
+    and converts it to a database document.
+
+    :param resource: the Eve resource name
+    :param value: the payload document
+    :param date_utc: the creation date
+    :return: the raw database document
+    :raise PayloadError: if the document is invalid
+    """
+    resource_def = app.config['DOMAIN'][resource]
+    validator = app.validator(resource_def['schema'], resource)
+    document = parse(value, resource)
+    resolve_default_values(document, resource_def['defaults'])
+    if not validator.validate(document):
+        raise PayloadError(validator.errors)
+    document[config.LAST_UPDATED] = document[config.DATE_CREATED] = date_utc
+    try:
+        model = app.data._doc_to_model(resource, document)
+        model.validate()
+    except (ValidationError, TypeError, ValueError) as e:
+        raise PayloadError({'validation exception': str(e)})
+
+    return model.to_mongo()
+
+
+def _insert(model, items):
+    """
+    Inserts the given documents in unordered batches of
+    :const:`BATCH_SIZE`.
+
+    :param model: the document class
+    :param items: the (item index, raw document) list
+    :return: the {item index: error message} dictionary of the
+        documents which were not inserted
+    """
+    collection = model._get_collection()
+    errors = {}
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        try:
+            collection.insert_many([doc for _, doc in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                i, _ = batch[error['index']]
+                errors.setdefault(i, error['errmsg'])
+
+    return errors
+
+
+def _failure(issues):
+    """
+    :param issues: the {field: issue} dictionary
+    :return: the failed item result
+    """
+    return {config.STATUS: config.STATUS_ERR, config.ISSUES: issues}
+
+
+def _raise_insert(resource, documents):
+    """
+    Raises the Eve insert events for the given resource documents
+    before they are inserted.
+
+    :param resource: the Eve resource name
+    :param documents: the raw documents to insert
+    """
+    getattr(app, 'on_insert')(resource, documents)
+    getattr(app, 'on_insert_%s' % resource)(documents)
+
+
+def _raise_inserted(resource, documents):
+    """
+    Raises the Eve inserted events for the given resource documents.
+
+    :param resource: the Eve resource name
+    :param documents: the inserted raw documents
+    """
+    getattr(app, 'on_inserted')(resource, documents)
+    getattr(app, 'on_inserted_%s' % resource)(documents)
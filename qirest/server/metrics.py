@@ -0,0 +1,414 @@
+"""
+The qirest request metrics.
+
+The metrics consist of the following histograms, labeled by
+resource and request method:
+
+* the request latency in seconds
+
+* the response size in bytes
+
+* the number of Mongo data layer operations per request
+
+and the Mongo data layer operation counts labeled by resource and
+operation. The operations are the Eve data layer method calls and
+the Mongo count queries of a collection GET request. The metrics
+are served in the Prometheus text format at the :const:`METRICS_URL`
+endpoint, e.g.::
+
+    curl http://localhost:5000/metrics
+
+Recording a request costs a few dictionary lookups and a bisection.
+The text is only formatted when the endpoint is requested.
+
+If the ``METRICS_DOCUMENT_BYTES`` setting is enabled, then the BSON
+size of the documents which the data layer reads and writes is
+counted by resource and direction as well. This costs a second
+encoding of each document, so it is disabled by default.
+
+A streamed response is recorded when the response is closed, so the
+latency is the time until the last line is sent and the size is the
+number of bytes sent.
+
+:Note: the installed pymongo does not report the bytes on the wire.
+    The document bytes do not include the Mongo command and reply
+    envelopes, and the documents which are read or written outside
+    of the Eve data layer are not counted.
+
+:Note: the metrics are kept in process memory. A pre-fork WSGI server
+    worker reports only the requests which that worker served.
+"""
+
+import time
+import bisect
+import threading
+from bson import BSON
+from bson.errors import InvalidDocument
+from flask import (request, g, Response, has_request_context)
+from .datalayer import KeysetPage
+
+METRICS_URL = '/metrics'
+"""The metrics endpoint."""
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+"""The request latency histogram bucket upper bounds in seconds."""
+
+SIZE_BUCKETS = [2 ** n for n in range(8, 28, 2)]
+"""The response size histogram bucket upper bounds in bytes."""
+
+OPERATION_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256]
+"""The per-request Mongo operation count histogram bucket upper bounds."""
+
+DATA_OPERATIONS = ['find', 'find_one', 'find_one_raw', 'find_list_of_ids',
+                   'find_in', 'insert', 'update', 'replace', 'remove',
+                   'is_empty']
+"""The counted Eve data layer methods."""
+
+WRITE_ARGUMENTS = dict(insert=0, update=1, replace=1)
+"""
+The {data layer write method: written document argument index}
+dictionary. The index excludes the resource argument.
+"""
+
+RECEIVED = 'received'
+"""The document bytes direction label value of a read document."""
+
+SENT = 'sent'
+"""The document bytes direction label value of a written document."""
+
+
+class Histogram(object):
+    """A cumulative bucket histogram."""
+
+    def __init__(self, bounds):
+        """
+        :param bounds: the sorted bucket upper bounds
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        :param value: the value to record
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def format(self, name, labels):
+        """
+        :param name: the metric name
+        :param labels: the formatted labels
+        :return: the Prometheus text lines
+        """
+        lines = []
+        cumulative = 0
+        bounds = [str(bound) for bound in self.bounds] + ['+Inf']
+        for bound, count in zip(bounds, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' %
+                         (name, labels, bound, cumulative))
+        lines.append('%s_sum{%s} %s' % (name, labels, repr(self.sum)))
+        lines.append('%s_count{%s} %d' % (name, labels, self.count))
+
+        return lines
+
+
+class Registry(object):
+    """The metrics store."""
+
+    HISTOGRAMS = [
+        ('qirest_request_seconds', 'The request latency in seconds.',
+         LATENCY_BUCKETS),
+        ('qirest_response_bytes', 'The response body size in bytes.',
+         SIZE_BUCKETS),
+        ('qirest_request_mongo_operations',
+         'The number of Mongo data layer operations per request.',
+         OPERATION_BUCKETS)
+    ]
+    """The (name, help, bounds) request histogram definitions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+        self._operations = {}
+        self._bytes = {}
+
+    def observe(self, name, labels, value):
+        """
+        Records a histogram value.
+
+        :param name: the :const:`HISTOGRAMS` item name
+        :param labels: the (resource, method) tuple
+        :param value: the value to record
+        """
+        histograms = self._histograms[name]
+        with self._lock:
+            histogram = histograms.get(labels)
+            if histogram is None:
+                bounds = next(b for n, _, b in self.HISTOGRAMS if n == name)
+                histogram = histograms[labels] = Histogram(bounds)
+            histogram.observe(value)
+
+    def count_operation(self, resource, operation):
+        """
+        Increments a Mongo data layer operation count.
+
+        :param resource: the Eve resource name
+        :param operation: the data layer method name
+        """
+        key = (resource, operation)
+        with self._lock:
+            self._operations[key] = self._operations.get(key, 0) + 1
+
+    def count_bytes(self, resource, direction, size):
+        """
+        Adds to a Mongo document byte count.
+
+        :param resource: the Eve resource name
+        :param direction: the :const:`RECEIVED` or :const:`SENT`
+            direction
+        :param size: the number of bytes
+        """
+        key = (resource, direction)
+        with self._lock:
+            self._bytes[key] = self._bytes.get(key, 0) + size
+
+    def format(self):
+        """
+        :return: the Prometheus text exposition
+        """
+        lines = []
+        with self._lock:
+            for name, text, _ in self.HISTOGRAMS:
+                lines.append('# HELP %s %s' % (name, text))
+                lines.append('# TYPE %s histogram' % name)
+                for (resource, method), histogram in \
+                        sorted(self._histograms[name].items()):
+                    labels = 'resource="%s",method="%s"' % (resource, method)
+                    lines.extend(histogram.format(name, labels))
+            name = 'qirest_mongo_operations_total'
+            lines.append('# HELP %s The Mongo data layer operation count.' %
+                         name)
+            lines.append('# TYPE %s counter' % name)
+            for (resource, operation), count in \
+                    sorted(self._operations.items()):
+                lines.append('%s{resource="%s",operation="%s"} %d' %
+                             (name, resource, operation, count))
+            name = 'qirest_mongo_document_bytes_total'
+            lines.append('# HELP %s The Mongo data layer document bytes.' %
+                         name)
+            lines.append('# TYPE %s counter' % name)
+            for (resource, direction), size in sorted(self._bytes.items()):
+                lines.append('%s{resource="%s",direction="%s"} %d' %
+                             (name, resource, direction, size))
+
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+"""The process metrics registry."""
+
+
+class RequestMetrics(object):
+    """The metrics of the current request."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.operations = 0
+        self.size = None
+        """The response size, or None if it is not known."""
+
+    def record(self, labels):
+        """
+        Records this request in the :const:`REGISTRY`.
+
+        :param labels: the (resource, method) tuple
+        """
+        REGISTRY.observe('qirest_request_seconds', labels,
+                         time.time() - self.start)
+        REGISTRY.observe('qirest_request_mongo_operations', labels,
+                         self.operations)
+        if self.size is not None:
+            REGISTRY.observe('qirest_response_bytes', labels, self.size)
+
+
+class MeasuredBody(object):
+    """The streamed response body which counts the sent bytes."""
+
+    def __init__(self, body, metrics):
+        """
+        :param body: the response body iterable
+        :param metrics: the :class:`RequestMetrics`
+        """
+        self._body = body
+        self._metrics = metrics
+        metrics.size = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            if isinstance(chunk, unicode):
+                self._metrics.size += len(chunk.encode('utf-8'))
+            else:
+                self._metrics.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        """Closes the wrapped body, e.g. to end a streamed context."""
+        close = getattr(self._body, 'close', None)
+        if close:
+            close()
+
+
+class CountedCursor(object):
+    """
+    The data layer find result which counts the Mongo count queries
+    and, optionally, the fetched document bytes. Eve calls the cursor
+    ``count`` method directly rather than through the data layer.
+    """
+
+    def __init__(self, resource, cursor, count_bytes=False):
+        """
+        :param resource: the Eve resource name
+        :param cursor: the data layer find result
+        :param count_bytes: whether to count the fetched document bytes
+        """
+        self._resource = resource
+        self._cursor = cursor
+        self._count_bytes = count_bytes
+
+    def __iter__(self):
+        if not self._count_bytes:
+            return iter(self._cursor)
+        return self._counted_iter()
+
+    def _counted_iter(self):
+        for doc in self._cursor:
+            _count_bytes(self._resource, RECEIVED, doc)
+            yield doc
+
+    def count(self, *args, **kwargs):
+        # A keyset page counts the fetched page without a query.
+        if not isinstance(self._cursor, KeysetPage):
+            _count_operation(self._resource, 'count')
+        return self._cursor.count(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def register(app):
+    """
+    Enables request metrics collection on the given Eve application
+    and adds the :const:`METRICS_URL` endpoint.
+
+    :param app: the Eve application
+    """
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    app.add_url_rule(METRICS_URL, 'metrics', view_func=_metrics,
+                     methods=['GET'])
+    count_bytes = app.config.get('METRICS_DOCUMENT_BYTES', False)
+    for name in DATA_OPERATIONS:
+        method = getattr(app.data, name, None)
+        if method:
+            setattr(app.data, name, _counted(name, method, count_bytes))
+
+
+def _resource():
+    """
+    :return: the Eve resource of the current request, or None if
+        the request is not a resource request
+    """
+    endpoint = request.endpoint or ''
+    if '|' in endpoint:
+        return endpoint.split('|', 1)[0]
+
+
+def _start_request():
+    g.metrics = RequestMetrics()
+
+
+def _end_request(response):
+    resource = _resource()
+    metrics = getattr(g, 'metrics', None)
+    if not resource or metrics is None:
+        return response
+    labels = (resource, request.method)
+    if response.is_streamed:
+        # A streamed response body is generated after this handler
+        # returns. Record the request when the response is closed.
+        response.response = MeasuredBody(response.response, metrics)
+        response.call_on_close(lambda: metrics.record(labels))
+    else:
+        metrics.size = response.content_length
+        metrics.record(labels)
+
+    return response
+
+
+def _counted(operation, method, count_bytes=False):
+    """
+    :param operation: the data layer method name
+    :param method: the bound data layer method
+    :param count_bytes: whether to count the document bytes
+    :return: the wrapper which counts the method calls and, optionally,
+        the document bytes
+    """
+    def counted(resource, *args, **kwargs):
+        _count_operation(resource, operation)
+        if count_bytes and operation in WRITE_ARGUMENTS:
+            _count_bytes(resource, SENT, args[WRITE_ARGUMENTS[operation]])
+        result = method(resource, *args, **kwargs)
+        if operation == 'find':
+            return CountedCursor(resource, result, count_bytes)
+        if not count_bytes:
+            return result
+        if operation in ('find_one', 'find_one_raw'):
+            _count_bytes(resource, RECEIVED, result)
+        elif operation == 'find_in':
+            _count_bytes(resource, RECEIVED, result.values())
+        return result
+
+    return counted
+
+
+def _count_operation(resource, operation):
+    """
+    Counts a Mongo operation in the registry and the current request.
+
+    :param resource: the Eve resource name
+    :param operation: the operation name
+    """
+    REGISTRY.count_operation(resource, operation)
+    if has_request_context() and hasattr(g, 'metrics'):
+        g.metrics.operations += 1
+
+
+def _count_bytes(resource, direction, docs):
+    """
+    Counts the BSON size of the given documents. A value which is
+    not BSON-encodable is not counted.
+
+    :param resource: the Eve resource name
+    :param direction: the :const:`RECEIVED` or :const:`SENT` direction
+    :param docs: the document, document list or None
+    """
+    if docs is None:
+        return
+    if isinstance(docs, dict):
+        docs = [docs]
+    size = 0
+    for doc in docs:
+        try:
+            size += len(BSON.encode(doc))
+        except (InvalidDocument, TypeError):
+            pass
+    REGISTRY.count_bytes(resource, direction, size)
+
+
+def _metrics():
+    """The :const:`METRICS_URL` endpoint view."""
+    return Response(REGISTRY.format(), mimetype='text/plain')
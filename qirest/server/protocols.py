@@ -0,0 +1,136 @@
+"""
+The qirest protocol registry.
+
+A modeling, scan or registration object refers to one of a few
+Protocol documents, which are looked up by technique and
+configuration. The :const:`REGISTRY` loads the protocols once and
+serves the lookups from memory, e.g.::
+
+    from qirest.server.protocols import REGISTRY
+    t1 = REGISTRY.get_or_create('T1')
+
+The registry is invalidated when the ``protocol`` resource is
+written through an Eve application on which :meth:`register` is
+called.
+
+:Note: the registry is kept in process memory. A protocol write
+    which does not go through the Eve application of this process,
+    e.g. a direct database write or a write served by another
+    WSGI worker, is not seen until :meth:`ProtocolRegistry.invalidate`
+    is called.
+"""
+
+import threading
+from qirest_client.model.imaging import Protocol
+from qirest.server import upsert
+
+PROTOCOL_RESOURCE = 'protocol'
+"""The protocol Eve resource name."""
+
+WRITE_EVENTS = ['on_inserted_', 'on_updated_', 'on_replaced_',
+                'on_deleted_item_', 'on_deleted_resource_']
+"""The Eve resource write event name prefixes."""
+
+
+class ProtocolRegistry(object):
+    """The cached {(technique, configuration): protocol} lookup."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._protocols = None
+        self.round_trips = 0
+        """The number of database requests made by this registry."""
+
+    def get(self, technique, configuration=None):
+        """
+        :param technique: the protocol technique
+        :param configuration: the protocol configuration dictionary
+        :return: the matching protocol, or None if there is no match
+        """
+        key = _protocol_key(technique, configuration)
+        with self._lock:
+            return self._load().get(key)
+
+    def get_or_create(self, technique, configuration=None, **defaults):
+        """
+        :param technique: the protocol technique
+        :param configuration: the protocol configuration dictionary
+        :param defaults: the additional content of a created protocol,
+            e.g. the protocol id
+        :return: the matching protocol, which is created if necessary
+        """
+        key = _protocol_key(technique, configuration)
+        with self._lock:
+            protocols = self._load()
+            protocol = protocols.get(key)
+            if protocol is None:
+                content = dict(defaults, technique=technique)
+                if configuration:
+                    content['configuration'] = configuration
+                fields = upsert.NATURAL_KEYS[PROTOCOL_RESOURCE]
+                protocol = upsert.get_or_insert(Protocol, content, fields)
+                self.round_trips += 1
+                protocols[key] = protocol
+
+        return protocol
+
+    def invalidate(self):
+        """Discards the cached protocols."""
+        with self._lock:
+            self._protocols = None
+
+    def _load(self):
+        """
+        :return: the cached protocols, which are fetched from the
+            database in one query if necessary
+        """
+        if self._protocols is None:
+            self._protocols = {
+                _protocol_key(pcl.technique, pcl.configuration): pcl
+                for pcl in Protocol.objects
+            }
+            self.round_trips += 1
+
+        return self._protocols
+
+
+REGISTRY = ProtocolRegistry()
+"""The process protocol registry."""
+
+
+def register(app):
+    """
+    Invalidates the :const:`REGISTRY` when the given Eve application
+    writes the ``protocol`` resource.
+
+    :param app: the Eve application
+    """
+    for prefix in WRITE_EVENTS:
+        event = getattr(app, prefix + PROTOCOL_RESOURCE)
+        event += _invalidate
+
+
+def _invalidate(*args):
+    REGISTRY.invalidate()
+
+
+def _protocol_key(technique, configuration):
+    """
+    :param technique: the protocol technique
+    :param configuration: the protocol configuration dictionary
+    :return: the hashable registry key
+    """
+    return technique, _freeze(configuration or {})
+
+
+def _freeze(value):
+    """
+    :param value: the configuration value
+    :return: the hashable equivalent value
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+
+    return value
@@ -0,0 +1,272 @@
+"""
+The qirest response renderers.
+
+The optional fast JSON renderer encodes the response with the
+ujson_ C encoder. The encoder does not call back into Python
+for unsupported types, so the datetime, ObjectId, UUID and Decimal
+values are first converted to their JSON equivalents by
+:meth:`to_native`. The fast renderer is enabled by the
+``JSON_RENDERER`` setting value ``fast``. If ujson is not
+installed, then the stock Eve JSON renderer is used.
+
+:Note: ujson rounds a float to :const:`DOUBLE_PRECISION` decimal
+    places rather than significant digits, so a small float loses
+    precision, e.g. ``1e-17`` is rendered as ``0.0``. The stock
+    renderer is therefore the default.
+
+If the optional msgpack_ package is installed, then a request
+which accepts the :const:`MSGPACK_MIMETYPE` is answered in the
+MessagePack binary format. A POST, PATCH or PUT request body of
+that type is converted to JSON before it reaches Eve.
+
+.. _ujson: https://pypi.python.org/pypi/ujson
+
+.. _msgpack: https://pypi.python.org/pypi/msgpack-python
+"""
+
+import io
+import json
+import datetime
+from uuid import UUID
+from decimal import Decimal
+from bson import ObjectId
+from eve import render
+from eve.utils import config
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FAST_JSON_RENDERER = 'render_fast_json'
+"""The fast JSON renderer function name."""
+
+DOUBLE_PRECISION = 15
+"""
+The number of encoded float decimal digits. This is the ujson maximum.
+The ujson default is 9.
+"""
+
+MSGPACK_RENDERER = 'render_msgpack'
+"""The MessagePack renderer function name."""
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+"""The MessagePack MIME type."""
+
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+"""The accepted MessagePack MIME types."""
+
+WRITE_METHODS = ['POST', 'PATCH', 'PUT']
+"""The request methods with a request body."""
+
+SCALAR_TYPES = set([str, unicode, int, long, float, bool, type(None)])
+"""The types which the JSON encoder handles natively."""
+
+
+def register(app):
+    """
+    Adds the fast JSON renderer to the Eve renderers. If the
+    application ``JSON_RENDERER`` setting is ``fast`` and ujson
+    is installed, then the fast renderer replaces the stock
+    JSON renderer.
+
+    :param app: the Eve application
+    """
+    setattr(render, FAST_JSON_RENDERER, render_fast_json)
+    if app.config.get('JSON_RENDERER') == 'fast' and ujson:
+        for mime in render._MIME_TYPES:
+            if mime['tag'] == 'JSON':
+                mime['renderer'] = FAST_JSON_RENDERER
+    # The MessagePack renderer follows the JSON and XML renderers,
+    # so that it is only chosen if the request asks for it.
+    if msgpack:
+        setattr(render, MSGPACK_RENDERER, render_msgpack)
+        if not any(mime['tag'] == 'MSGPACK' for mime in render._MIME_TYPES):
+            render._MIME_TYPES.append(dict(mime=MSGPACK_MIMETYPES,
+                                           renderer=MSGPACK_RENDERER,
+                                           tag='MSGPACK'))
+        app.wsgi_app = MsgpackRequestMiddleware(app.wsgi_app)
+
+
+def json_renderer():
+    """
+    :return: the active Eve JSON render function
+    """
+    name = next(mime['renderer'] for mime in render._MIME_TYPES
+                if mime['tag'] == 'JSON')
+
+    return getattr(render, name)
+
+
+def render_fast_json(data):
+    """
+    The fast JSON render function.
+
+    :param data: the response data
+    :return: the JSON string
+    """
+    if not ujson:
+        return render.render_json(data)
+    native = to_native(data, config.DATE_FORMAT)
+
+    return ujson.dumps(native, ensure_ascii=False,
+                       double_precision=DOUBLE_PRECISION)
+
+
+def render_msgpack(data):
+    """
+    The MessagePack render function.
+
+    :param data: the response data
+    :return: the MessagePack bytes
+    """
+    def default(value):
+        native = _native_scalar(value, config.DATE_FORMAT)
+        if native is value:
+            raise TypeError("Cannot serialize %r" % value)
+        return native
+
+    # A Python 2 str is text in the response, not binary data, e.g.
+    # a field name or a formatted ObjectId. Pack it as a string.
+    return msgpack.packb(data, default=default, use_bin_type=False)
+
+
+class MsgpackRequestMiddleware(object):
+    """
+    The WSGI middleware which converts a MessagePack request body to
+    JSON. Eve only parses a JSON or form request body.
+    """
+
+    def __init__(self, wsgi_app):
+        """
+        :param wsgi_app: the wrapped WSGI application
+        """
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        content_type = environ.get('CONTENT_TYPE', '').split(';')[0].strip()
+        method = environ.get('REQUEST_METHOD')
+        if content_type in MSGPACK_MIMETYPES and method in WRITE_METHODS:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length)
+            try:
+                body = json.dumps(_unpackb(body)).encode('utf-8')
+            except Exception as e:
+                return _bad_request(start_response,
+                                    "Unable to parse the MessagePack"
+                                    " request body: %s" % e)
+            environ['CONTENT_TYPE'] = 'application/json'
+            environ['CONTENT_LENGTH'] = str(len(body))
+            environ['wsgi.input'] = io.BytesIO(body)
+
+        return self.wsgi_app(environ, start_response)
+
+
+def to_native(value, date_format):
+    """
+    Converts the given value to JSON-native types, i.e. dictionaries,
+    lists, strings, numbers, booleans and None. A datetime is
+    formatted as in Eve, an ObjectId or UUID is formatted as a string
+    and a Decimal is converted to a float.
+
+    :param value: the value to convert
+    :param date_format: the datetime format
+    :return: the converted value
+    """
+    value_type = type(value)
+    if value_type in SCALAR_TYPES:
+        return value
+    if isinstance(value, dict):
+        return {key: (v if type(v) in SCALAR_TYPES
+                      else to_native(v, date_format))
+                for key, v in value.iteritems()}
+    if isinstance(value, (list, tuple)):
+        return [v if type(v) in SCALAR_TYPES else to_native(v, date_format)
+                for v in value]
+
+    return _native_scalar(value, date_format)
+
+
+def _native_scalar(value, date_format):
+    """
+    :param value: the non-container value to convert
+    :param date_format: the datetime format
+    :return: the JSON-native value, or the given value if it is not
+        a supported type
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime(date_format)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (ObjectId, UUID)):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    # Fall back to the encoder, which fails on an unsupported type.
+    return value
+
+
+def _unpackb(body):
+    """
+    :param body: the MessagePack bytes
+    :return: the decoded content with text strings
+    :raise ValueError: if the content has a binary or extension value,
+        which has no JSON equivalent
+    """
+    # The raw option supersedes the encoding option in msgpack 0.5.2.
+    try:
+        content = msgpack.unpackb(body, raw=False, ext_hook=_reject_ext)
+    except TypeError:
+        content = msgpack.unpackb(body, encoding='utf-8',
+                                  ext_hook=_reject_ext)
+    _check_text(content)
+
+    return content
+
+
+def _reject_ext(code, data):
+    """
+    The MessagePack extension type hook.
+
+    :raise ValueError: always
+    """
+    raise ValueError("The MessagePack extension type %d is not supported" %
+                     code)
+
+
+def _check_text(value):
+    """
+    :param value: the decoded MessagePack value
+    :raise ValueError: if the value has a binary value
+    """
+    # The string values are decoded as unicode, so a bytes value is
+    # a MessagePack binary value.
+    if isinstance(value, bytes):
+        raise ValueError("The MessagePack binary type is not supported")
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            _check_text(key)
+            _check_text(item)
+    elif isinstance(value, list):
+        for item in value:
+            _check_text(item)
+
+
+def _bad_request(start_response, message):
+    """
+    Responds with an Eve-style 400 error.
+
+    :param start_response: the WSGI start_response callable
+    :param message: the error message
+    :return: the WSGI response body iterable
+    """
+    error = dict(_status='ERR', _error=dict(code=400, message=message))
+    body = json.dumps(error).encode('utf-8')
+    start_response('400 BAD REQUEST',
+                   [('Content-Type', 'application/json'),
+                    ('Content-Length', str(len(body)))])
+
+    return [body]
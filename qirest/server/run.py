@@ -1,24 +1,96 @@
 #!/usr/bin/env python
+import os
+import logging
 import importlib
 import mongoengine
 from eve import Eve
-from eve_mongoengine import EveMongoengine
 from qirest_client.model.subject import (Project, ImagingCollection, Subject)
 from qirest_client.model.imaging import (SessionDetail, Scan, Protocol)
+from qirest.server.datalayer import MongoengineExtension
+from qirest.server import (streaming, indexes, metrics, embedding, render,
+                           protocols, aggregation, timeline, ingest, upsert,
+                           encounters)
+
+SETTINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'settings.py')
+"""
+The Eve settings file. The absolute path allows the application
+to be imported from outside of this directory.
+"""
+
+SUBJECT_KEYSET = ['project', 'collection', 'number']
+"""
+The subject keyset pagination sort order. The secondary key is
+unique, so an id tie-breaker is unnecessary.
+"""
+
+SESSION_DETAIL_KEYSET = ['_id']
+"""
+The session detail keyset pagination sort order. A session detail
+does not have a secondary key, so the detail is paged in id order.
+"""
 
 # The application.
-app = Eve()
+app = Eve(settings=SETTINGS)
 
 # The MongoEngine ORM extension.
-ext = EveMongoengine(app)
+ext = MongoengineExtension(app)
 
 # Register the model non-embedded documdent classes.
 ext.add_model(Project, url='project')
 ext.add_model(ImagingCollection, url='imaging-collection')
-ext.add_model(Subject, url='subject')
-ext.add_model(SessionDetail, url='session-detail')
+ext.add_model(Subject, url='subject', keyset=SUBJECT_KEYSET)
+ext.add_model(SessionDetail, url='session-detail',
+              keyset=SESSION_DETAIL_KEYSET)
 ext.add_model(Protocol, url='protocol')
 
+# Add the optional response renderers.
+render.register(app)
+
+# Embed the subject session details on request.
+embedding.register(app)
+
+# Invalidate the cached protocols when a protocol is written.
+protocols.register(app)
+
+# Summarize the cohort modeling parameters.
+aggregation.register(app)
+
+# Maintain and serve the subject timelines.
+timeline.register(app)
+
+# Accept the bulk subject ingest requests.
+ingest.register(app)
+
+# Upsert the subjects and protocols by natural key.
+upsert.register(app)
+
+# Append or patch a single subject encounter.
+encounters.register(app)
+
+# Collect the request metrics.
+if app.config['METRICS']:
+    metrics.register(app)
+
+# Stream the collection GET NDJSON requests.
+streaming.register(app)
+
+
+def warn_missing_indexes():
+    """
+    Logs a warning for each :const:`qirest.server.indexes.INDEXES`
+    item which is missing from the database. The missing indexes
+    are created by the ``qirest db init`` command.
+    """
+    logger = logging.getLogger(__name__)
+    for collection, keys in indexes.missing_indexes():
+        fields = ', '.join(field for field, _ in keys)
+        logger.warning("The %s collection is missing the (%s) index."
+                       " Run 'qirest db init' to create the index." %
+                       (collection, fields))
+
 
 if __name__ == '__main__':
+    logging.basicConfig()
+    warn_missing_indexes()
     app.run()
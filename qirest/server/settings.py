@@ -52,6 +52,30 @@ if pswd:
 # Disable pagination.
 PAGINATION = False
 
+# The subject and session detail resources support opt-in keyset
+# pagination by the max_results or cursor request parameter.
+# The default keyset page size.
+KEYSET_PAGINATION_DEFAULT = 25
+# The maximum keyset page size.
+KEYSET_PAGINATION_LIMIT = 500
+
+# The JSON renderer is either 'stock' for the Eve JSON renderer
+# or 'fast' for the ujson renderer, if ujson is installed. The fast
+# renderer rounds a float to 15 decimal places, e.g. 1e-17 is
+# rendered as 0.0, so the stock renderer is the default.
+JSON_RENDERER = 'stock'
+
+# Collect the request metrics and serve them at /metrics.
+METRICS = True
+
+# Count the BSON size of the documents read and written by the data
+# layer in the request metrics. This encodes each document a second
+# time, and is only enabled to diagnose a payload size problem.
+METRICS_DOCUMENT_BYTES = False
+
+# The maximum number of subjects in a bulk /ingest request.
+INGEST_LIMIT = 1000
+
 # Even though the domain is defined by the Eve MongoEngine
 # adapter, a DOMAIN setting is required by Eve. This setting
 # is only used to avoid an Eve complaint about a missing domain.
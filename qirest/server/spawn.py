@@ -1,28 +1,198 @@
 import sys
 import os
-from subprocess import (Popen, PIPE, STDOUT)
+import time
+import signal
+from subprocess import Popen
 
 APP = os.path.abspath(os.path.join(os.path.dirname(__file__), 'run.py'))
 """The Python script to run."""
 
+WSGI_APP = 'qirest.server.wsgi:app'
+"""The WSGI server application module and variable."""
 
-def spawn():
+WSGI_SERVER = 'gunicorn'
+"""The pre-fork WSGI server executable."""
+
+WSGI_OPTS = dict(
+    bind='127.0.0.1:5000',
+    threads=1,
+    keep_alive=5,
+    max_requests=0,
+    graceful_timeout=30
+)
+"""
+The WSGI server default options. The default bind address is the
+Flask development server address. A *max_requests* value of zero
+disables worker recycling.
+"""
+
+RESTART_DELAY = 1
+"""The initial supervisor restart delay in seconds."""
+
+MAX_RESTART_DELAY = 60
+"""The supervisor restart delay upper bound in seconds."""
+
+STABLE_UPTIME = 60
+"""
+The number of seconds a server must run before a crash is no
+longer regarded as part of a crash loop. The restart delay is
+reset to :const:`RESTART_DELAY` after a stable run.
+"""
+
+FORWARDED_SIGNALS = ['SIGINT', 'SIGTERM', 'SIGHUP']
+"""The signals which are forwarded to the server process."""
+
+STOP_SIGNALS = ['SIGINT', 'SIGTERM']
+"""The forwarded signals which stop the supervisor."""
+
+
+def spawn(supervise=False, **opts):
     """
     Start the Quantitaive Imaging Profile REST server.
-    
+
+    If the *workers* option is set, then the server is a
+    :const:`WSGI_SERVER` with that many pre-forked worker processes.
+    Otherwise, the server is the Flask development server.
+
+    The server process writes directly to this process's standard
+    output and error, so there is no per-line copying overhead.
+    The :const:`FORWARDED_SIGNALS` received by this process are
+    forwarded to the server.
+
+    :param supervise: flag indicating whether to restart the server
+        if it crashes
+    :param opts: the :meth:`wsgi_command` options
     :return: the completed process return code
     """
-    # The cumbersome but apparently necessary idiom below is required to
-    # continuously pipe the server output to the console
-    # (cf. http://stackoverflow.com/questions/4417546/constantly-print-subprocess-output-while-process-is-running).
-    proc = Popen(['python', APP], stdout=PIPE, stderr=STDOUT)
-    while True:
-        line = proc.stdout.readline()
-        if line == '' and proc.poll() != None:
-            break
-        sys.stdout.write(line)
-        sys.stdout.flush()
-    out, _ = proc.communicate()
-    rc = proc.returncode
-    
-    return rc
+    if opts.get('workers'):
+        cmd = wsgi_command(**opts)
+    else:
+        cmd = ['python', APP]
+
+    return Supervisor(cmd, restart=supervise).run()
+
+
+class Supervisor(object):
+    """
+    The server process supervisor. If the *restart* flag is set,
+    then a server which exits with a non-zero return code is
+    restarted after an exponentially increasing delay, bounded by
+    :const:`MAX_RESTART_DELAY`.
+    """
+
+    def __init__(self, cmd, restart=False):
+        """
+        :param cmd: the server command line arguments
+        :param restart: flag indicating whether to restart the server
+            if it crashes
+        """
+        self.cmd = cmd
+        self.restart = restart
+        self._proc = None
+        self._stopping = False
+
+    def run(self):
+        """
+        Runs the server until it exits cleanly, is stopped by a
+        :const:`STOP_SIGNALS` signal or, if the *restart* flag is
+        not set, crashes.
+
+        :return: the last server process return code
+        """
+        handlers = self._install_handlers()
+        try:
+            delay = RESTART_DELAY
+            while True:
+                started = time.time()
+                rc = self._run_once()
+                if rc == 0 or self._stopping or not self.restart:
+                    return rc
+                if time.time() - started > STABLE_UPTIME:
+                    delay = RESTART_DELAY
+                sys.stderr.write("The server exited with return code %d."
+                                 " Restarting in %d seconds...\n" %
+                                 (rc, delay))
+                self._sleep(delay)
+                if self._stopping:
+                    return rc
+                delay = min(delay * 2, MAX_RESTART_DELAY)
+        finally:
+            for signum, handler in handlers.iteritems():
+                signal.signal(signum, handler)
+
+    def _run_once(self):
+        """
+        Starts the server and waits for it to exit. On POSIX, the
+        server runs in its own process group, so that a terminal
+        interrupt reaches the server only once, by way of
+        :meth:`_forward`.
+
+        :return: the server process return code
+        """
+        setpgrp = getattr(os, 'setpgrp', None)
+        self._proc = Popen(self.cmd, preexec_fn=setpgrp)
+
+        return self._proc.wait()
+
+    def _sleep(self, seconds):
+        """Sleeps for the given duration or until stopped."""
+        deadline = time.time() + seconds
+        while not self._stopping and time.time() < deadline:
+            time.sleep(min(1, deadline - time.time()))
+
+    def _install_handlers(self):
+        """
+        :return: the replaced {signal number: handler} dictionary
+        """
+        handlers = {}
+        for name in FORWARDED_SIGNALS:
+            # Not every signal is defined on every platform.
+            signum = getattr(signal, name, None)
+            if signum is not None:
+                handlers[signum] = signal.signal(signum, self._forward)
+
+        return handlers
+
+    def _forward(self, signum, frame):
+        """The signal handler which relays the signal to the server."""
+        stop_signums = [getattr(signal, name, None) for name in STOP_SIGNALS]
+        if signum in stop_signums:
+            self._stopping = True
+        if self._proc and self._proc.poll() is None:
+            self._proc.send_signal(signum)
+
+
+def wsgi_command(workers, **opts):
+    """
+    Makes the :const:`WSGI_SERVER` command line. Each worker serves
+    requests with the given number of threads. A worker is gracefully
+    restarted after it serves *max_requests* requests. The restart is
+    staggered by up to ten percent of *max_requests*, so that the
+    workers are not recycled at the same time.
+
+    :param workers: the number of worker processes
+    :param opts: the following options:
+    :keyword bind: the server host:port address
+    :keyword threads: the number of threads per worker
+    :keyword keep_alive: the number of seconds to wait for a request
+        on a keep-alive connection
+    :keyword max_requests: the number of requests a worker serves
+        before it is recycled
+    :keyword graceful_timeout: the number of seconds a recycled or
+        stopped worker is given to finish its requests
+    :return: the command line arguments list
+    """
+    values = WSGI_OPTS.copy()
+    values.update((k, v) for k, v in opts.iteritems()
+                  if k in WSGI_OPTS and v is not None)
+    jitter = values['max_requests'] // 10
+
+    return [WSGI_SERVER,
+            '--workers', str(workers),
+            '--threads', str(values['threads']),
+            '--bind', values['bind'],
+            '--keep-alive', str(values['keep_alive']),
+            '--max-requests', str(values['max_requests']),
+            '--max-requests-jitter', str(jitter),
+            '--graceful-timeout', str(values['graceful_timeout']),
+            WSGI_APP]
@@ -0,0 +1,153 @@
+"""
+The qirest newline-delimited JSON (NDJSON) collection streaming.
+
+A collection GET request which either accepts the
+:const:`NDJSON_MIMETYPE` or sets the ``stream`` request parameter,
+e.g.::
+
+    curl -H 'Accept: application/x-ndjson' http://localhost:5000/subject
+    curl http://localhost:5000/subject?stream=1
+
+is answered with one JSON document per line. The documents are
+written as they are read from the Mongo cursor, so the server
+memory is bounded by the cursor batch rather than the collection
+size.
+
+The streamed request is authorized, rate limited and announced by
+the Eve ``on_pre_GET`` events as in an Eve collection GET request.
+The Eve fetched resource events are raised for each batch of
+:const:`STREAM_BATCH_SIZE` documents, e.g. to embed the batch
+session details.
+
+:Note: the streamed response is not wrapped in the Eve ``_items``
+    envelope. The whole collection is streamed, so a streamed
+    request cannot set the ``max_results`` or ``cursor`` keyset
+    pagination parameters.
+"""
+
+from functools import wraps
+from flask import (request, abort, Response, stream_with_context,
+                   current_app as app)
+from eve.auth import requires_auth
+from eve.utils import (config, parse_request)
+from eve.methods.common import (ratelimit, pre_event, build_response_document,
+                                resolve_embedded_fields)
+from .render import json_renderer
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+"""The newline-delimited JSON MIME type."""
+
+STREAM_PARAM_VALUES = ['1', 'true', 'yes']
+"""The ``stream`` request parameter values which enable streaming."""
+
+RESOURCE_ENDPOINT_SUFFIX = '|resource'
+"""The Eve collection endpoint name suffix."""
+
+PAGINATION_PARAMS = ['max_results', 'cursor']
+"""The keyset pagination parameters, which a streamed request cannot set."""
+
+STREAM_BATCH_SIZE = 100
+"""The number of documents passed to each fetched resource event."""
+
+
+def register(app):
+    """
+    Enables NDJSON streaming on the given Eve application.
+
+    :param app: the Eve application
+    """
+    for endpoint, view in app.view_functions.items():
+        if endpoint.endswith(RESOURCE_ENDPOINT_SUFFIX):
+            app.view_functions[endpoint] = _streamable(view)
+
+
+def is_stream_request():
+    """
+    :return: whether the current request asks for a streamed
+        NDJSON response
+    """
+    if request.args.get('stream', '').lower() in STREAM_PARAM_VALUES:
+        return True
+    mimetypes = request.accept_mimetypes
+    best = mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+
+    return best == NDJSON_MIMETYPE
+
+
+@ratelimit()
+@requires_auth('resource')
+@pre_event
+def stream(resource, **lookup):
+    """
+    Streams the resource documents which match the current request.
+
+    :param resource: the Eve resource name
+    :param lookup: the sub-resource lookup
+    :return: the streamed NDJSON response
+    """
+    params = [param for param in PAGINATION_PARAMS if param in request.args]
+    if params:
+        abort(400, description="A streamed request cannot set the %s"
+                               " parameter" % ', '.join(params))
+    req = parse_request(resource)
+    embedded_fields = resolve_embedded_fields(resource, req)
+    # Query before the response starts, so that an invalid request
+    # is answered with an error status.
+    cursor = app.data.find(resource, req, lookup)
+
+    return Response(stream_with_context(_generate(resource, cursor,
+                                                  embedded_fields)),
+                    mimetype=NDJSON_MIMETYPE)
+
+
+def _streamable(view):
+    """
+    :param view: the Eve collection endpoint view
+    :return: the view which streams a :meth:`is_stream_request`
+        GET request
+    """
+    @wraps(view)
+    def streamable(**lookup):
+        if request.method == 'GET' and is_stream_request():
+            resource = request.endpoint[:-len(RESOURCE_ENDPOINT_SUFFIX)]
+            return stream(resource, lookup)
+        return view(**lookup)
+
+    return streamable
+
+
+def _generate(resource, cursor, embedded_fields):
+    """
+    :param resource: the Eve resource name
+    :param cursor: the data layer find result
+    :param embedded_fields: the Eve embedded fields
+    :yield: the rendered JSON document lines
+    """
+    render_json = json_renderer()
+    batch = []
+    for doc in cursor:
+        build_response_document(doc, resource, embedded_fields)
+        batch.append(doc)
+        if len(batch) == STREAM_BATCH_SIZE:
+            for line in _render_batch(resource, batch, render_json):
+                yield line
+            batch = []
+    if batch:
+        for line in _render_batch(resource, batch, render_json):
+            yield line
+
+
+def _render_batch(resource, batch, render_json):
+    """
+    Raises the Eve fetched resource events for the given documents.
+
+    :param resource: the Eve resource name
+    :param batch: the response documents
+    :param render_json: the JSON renderer function
+    :return: the rendered JSON document lines
+    """
+    response = {config.ITEMS: batch}
+    getattr(app, 'on_fetched_resource')(resource, response)
+    getattr(app, 'on_fetched_resource_%s' % resource)(response)
+
+    return [render_json(doc) + '\n' for doc in response[config.ITEMS]]
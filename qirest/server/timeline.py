@@ -0,0 +1,304 @@
+"""
+The qirest subject modeling timeline.
+
+A chart client only needs the subject session dates, tumor extents
+and modeling parameter averages. These are kept in a compact derived
+timeline document per subject, e.g.::
+
+    {
+        "_id": <subject id>, "project": "QIN_Test",
+        "collection": "Breast", "number": 1,
+        "sessions": [
+            {"date": ..., "tumor_extents": [{"length": 42, ...}],
+             "modelings": [{"fxl_k_trans": 0.21, ...}]},
+            ...
+        ]
+    }
+
+The timeline is refreshed by the ``subject`` resource write event
+hooks. Subjects which are written directly to the database, e.g.
+by the seed helper, are picked up by :meth:`rebuild`, which is run
+by the ``qirest db timeline`` command.
+
+The timelines are served by the read-only :const:`TIMELINE_URL`
+endpoint, e.g.::
+
+    curl 'http://localhost:5000/timeline?project=QIN_Test&collection=Breast'
+    curl http://localhost:5000/timeline/<subject id>
+
+The timeline list is paged in :const:`KEYSET` order. The page size is
+the ``max_results`` parameter, or the ``KEYSET_PAGINATION_DEFAULT``
+setting by default. The response ``_meta`` ``next`` item is the
+``cursor`` parameter of the following page, e.g.::
+
+    curl 'http://localhost:5000/timeline?project=QIN_Test&cursor=WyJRSU5fVGVzdCJd...'
+"""
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import (request, abort)
+import pymongo
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from mongoengine import (DynamicDocument, StringField, IntField)
+from eve.render import send_response
+from eve.utils import config
+from qirest_client.model.subject import Subject
+from qirest.server import datalayer
+
+TIMELINE_URL = '/timeline'
+"""The timeline endpoint."""
+
+MODELING_PARAMETERS = ['fxl_k_trans', 'fxr_k_trans', 'delta_k_trans', 'v_e',
+                       'tau_i']
+"""The timeline modeling result parameters."""
+
+FILTER_PARAMS = dict(project=unicode, collection=unicode, number=int)
+"""The timeline list request {parameter: type} filters."""
+
+KEYSET = ['project', 'collection', 'number']
+"""The timeline list order, which is the unique timeline index key."""
+
+DUPLICATE_KEY_ERROR = 11000
+"""The MongoDB duplicate key write error code."""
+
+SUBJECT_FIELDS = ['project', 'collection', 'number', 'encounters.date',
+                  'encounters.detail', 'encounters.tumor_extents',
+                  'encounters.modelings.result']
+"""The subject fields which are read to build a timeline."""
+
+BATCH_SIZE = 1000
+"""The maximum number of timelines in a bulk write."""
+
+
+class Timeline(DynamicDocument):
+    """The derived subject timeline document."""
+
+    meta = dict(collection='qiprofile_timeline')
+
+    project = StringField(required=True)
+
+    collection = StringField(required=True)
+
+    number = IntField(required=True)
+
+
+def register(app):
+    """
+    Maintains the timelines on the given Eve application ``subject``
+    writes and adds the :const:`TIMELINE_URL` endpoints.
+
+    :param app: the Eve application
+    """
+    app.on_inserted_subject += _inserted
+    app.on_updated_subject += _updated
+    app.on_replaced_subject += _updated
+    app.on_deleted_item_subject += _deleted_item
+    app.on_deleted_resource_subject += _deleted_resource
+    app.add_url_rule(TIMELINE_URL, 'timeline', view_func=_timelines,
+                     methods=['GET'])
+    app.add_url_rule(TIMELINE_URL + '/<subject_id>', 'timeline_item',
+                     view_func=_timeline, methods=['GET'])
+
+
+def build_timeline(subject):
+    """
+    :param subject: the raw subject document
+    :return: the raw timeline document
+    """
+    # A session is an encounter with a session detail reference.
+    sessions = [enc for enc in subject.get('encounters', [])
+                if enc.get('detail')]
+
+    return dict(_id=subject['_id'], project=subject['project'],
+                collection=subject['collection'], number=subject['number'],
+                sessions=[_session_timeline(sess) for sess in sessions])
+
+
+def refresh(subject_ids):
+    """
+    Rebuilds the timelines of the given subjects. The timeline of a
+    subject which is no longer in the database is removed.
+
+    :param subject_ids: the subject ids
+    """
+    subject_ids = list(subject_ids)
+    query = {'_id': {'$in': subject_ids}}
+    found = _write_timelines(_subject_collection().find(query, SUBJECT_FIELDS))
+    missing = set(subject_ids) - found
+    if missing:
+        query = {'_id': {'$in': list(missing)}}
+        Timeline._get_collection().delete_many(query)
+
+
+def rebuild():
+    """
+    Rebuilds all of the timelines from the subjects in the database
+    and removes the timelines of deleted subjects.
+
+    :return: the number of timelines
+    """
+    found = _write_timelines(_subject_collection().find({}, SUBJECT_FIELDS))
+    collection = Timeline._get_collection()
+    stale = [doc['_id'] for doc in collection.find({}, {'_id': 1})
+             if doc['_id'] not in found]
+    for start in range(0, len(stale), BATCH_SIZE):
+        query = {'_id': {'$in': stale[start:start + BATCH_SIZE]}}
+        collection.delete_many(query)
+
+    return len(found)
+
+
+def _session_timeline(session):
+    """
+    :param session: the raw session document
+    :return: the session timeline item
+    """
+    modelings = []
+    for modeling in session.get('modelings', []):
+        result = modeling.get('result', {})
+        averages = {}
+        for param in MODELING_PARAMETERS:
+            metadata = result.get(param, {}).get('image', {}).get('metadata')
+            if metadata and 'average_intensity' in metadata:
+                averages[param] = metadata['average_intensity']
+        modelings.append(averages)
+
+    return dict(date=session.get('date'),
+                tumor_extents=session.get('tumor_extents', []),
+                modelings=modelings)
+
+
+def _write_timelines(subjects):
+    """
+    Upserts the timelines of the given subjects in batches of
+    :const:`BATCH_SIZE`.
+
+    :param subjects: the raw subject documents iterable
+    :return: the written subject id set
+    """
+    collection = Timeline._get_collection()
+    written = set()
+    timelines = []
+    for subject in subjects:
+        timeline = build_timeline(subject)
+        timelines.append(timeline)
+        written.add(timeline['_id'])
+        if len(timelines) == BATCH_SIZE:
+            _replace_timelines(collection, timelines)
+            timelines = []
+    if timelines:
+        _replace_timelines(collection, timelines)
+
+    return written
+
+
+def _replace_timelines(collection, timelines):
+    """
+    Upserts the given timelines. The subject secondary key is unique,
+    so a timeline which holds the key of a written timeline is stale,
+    e.g. after two subject numbers are swapped. The stale timeline is
+    removed and the write is retried.
+
+    :param collection: the timeline pymongo collection
+    :param timelines: the raw timeline documents
+    """
+    requests = [ReplaceOne({'_id': timeline['_id']}, timeline, upsert=True)
+                for timeline in timelines]
+    try:
+        collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details['writeErrors']
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        for error in errors:
+            timeline = timelines[error['index']]
+            stale = {key: timeline[key] for key in KEYSET}
+            stale['_id'] = {'$ne': timeline['_id']}
+            collection.delete_one(stale)
+        retries = [requests[error['index']] for error in errors]
+        collection.bulk_write(retries, ordered=False)
+
+
+def _subject_collection():
+    return Subject._get_collection()
+
+
+def _inserted(items):
+    refresh(item[config.ID_FIELD] for item in items)
+
+
+def _updated(updates, original):
+    refresh([original[config.ID_FIELD]])
+
+
+def _deleted_item(item):
+    Timeline._get_collection().delete_one({'_id': item[config.ID_FIELD]})
+
+
+def _deleted_resource():
+    Timeline._get_collection().delete_many({})
+
+
+def _timelines():
+    """The :const:`TIMELINE_URL` list endpoint view."""
+    query = {}
+    for param, param_type in FILTER_PARAMS.iteritems():
+        value = request.args.get(param)
+        if value is not None:
+            try:
+                query[param] = param_type(value)
+            except ValueError:
+                abort(400, description="Invalid %s parameter: %s" %
+                                       (param, value))
+    limit = _page_size()
+    token = request.args.get('cursor')
+    if token:
+        values = datalayer.parse_cursor(token, KEYSET)
+        query.update(datalayer.keyset_after(KEYSET, values))
+    sort = [(key, pymongo.ASCENDING) for key in KEYSET]
+    # Fetch one more timeline than the page size to detect a next page.
+    items = list(Timeline._get_collection().find(query, sort=sort,
+                                                 limit=limit + 1))
+    meta = dict(max_results=limit)
+    if len(items) > limit:
+        items = items[:limit]
+        meta['next'] = datalayer.encode_cursor([items[-1][key]
+                                                for key in KEYSET])
+
+    return send_response(None, ({config.ITEMS: items, config.META: meta},))
+
+
+def _page_size():
+    """
+    :return: the ``max_results`` request parameter value, limited
+        to the ``KEYSET_PAGINATION_LIMIT`` setting
+    """
+    value = request.args.get('max_results')
+    if value is None:
+        return config.KEYSET_PAGINATION_DEFAULT
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size < 1:
+        abort(400, description="Invalid max_results parameter: %s" % value)
+
+    return min(size, config.KEYSET_PAGINATION_LIMIT)
+
+
+def _timeline(subject_id):
+    """
+    The :const:`TIMELINE_URL` item endpoint view.
+
+    :param subject_id: the subject id string
+    """
+    try:
+        oid = ObjectId(subject_id)
+    except InvalidId:
+        abort(404)
+    item = Timeline._get_collection().find_one({'_id': oid})
+    if not item:
+        abort(404)
+
+    return send_response(None, (item,))
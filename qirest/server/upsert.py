@@ -0,0 +1,286 @@
+"""
+The qirest natural key upsert.
+
+A subject is identified by its (project, collection, number) and a
+protocol by its (technique, configuration) natural key. A PUT
+request to the :const:`UPSERT_URL` endpoint replaces the document
+with the natural key of the request body, or inserts it if there is
+no such document, e.g.::
+
+    curl -X PUT -H 'Content-Type: application/json' \\
+         -d '{"project": "QIN", "collection": "Breast", "number": 1}' \\
+         http://localhost:5000/upsert/subject
+
+The natural key is taken from the request body rather than from an
+item URL, since the protocol ``configuration`` key is a nested
+dictionary which has no URL path form. Both resources are upserted
+in the same way for consistency.
+
+The request body is validated as in an Eve POST request. The
+replace or insert is a single atomic database operation. The
+response has the ``_id`` of the written document. The status is
+201 if the document is inserted, otherwise 200.
+
+The request is authorized and rate limited as an Eve item PUT
+request, and is authorized as an Eve collection POST request as
+well, since it can insert a document. The resource ``item_methods``
+must allow PUT and the ``resource_methods`` must allow POST. The
+Eve ``on_pre_PUT`` events are raised before the upsert, and the
+Eve inserted or replaced events are raised after it as in a POST or
+PUT request. The ``on_insert`` and ``on_replace`` events are not
+raised, since whether the atomic upsert inserts or replaces the
+document is only known after it is written.
+
+:Note: a configuration natural key value is matched with its
+    dictionary items in sorted order, which is the order in which
+    the upsert stores them. The ``qirest db init`` command rewrites
+    the protocols stored earlier with a different item order, see
+    :meth:`canonicalize_keys`.
+"""
+
+from datetime import datetime
+from bson import (ObjectId, SON)
+from bson.codec_options import CodecOptions
+from pymongo import (ReturnDocument, UpdateOne)
+from pymongo.errors import DuplicateKeyError
+from flask import (current_app as app, abort)
+from eve.auth import requires_auth
+from eve.utils import config
+from eve.methods.common import (payload, ratelimit, pre_event)
+from eve.render import send_response
+from qirest.server.ingest import (to_mongo, PayloadError, require_method,
+                                  authorize)
+
+UPSERT_URL = '/upsert/<resource>'
+"""The natural key upsert endpoint."""
+
+NATURAL_KEYS = dict(subject=['project', 'collection', 'number'],
+                    protocol=['technique', 'configuration'])
+"""The {Eve resource: natural key fields} dictionary."""
+
+BATCH_SIZE = 1000
+"""The maximum number of updates in a bulk write."""
+
+
+def register(app):
+    """
+    Adds the :const:`UPSERT_URL` endpoint to the given Eve
+    application.
+
+    :param app: the Eve application
+    """
+    app.add_url_rule(UPSERT_URL, 'upsert', view_func=_upsert_view,
+                     methods=['PUT'])
+
+
+def natural_key(fields, document):
+    """
+    :param fields: the natural key fields
+    :param document: the raw document
+    :return: the natural key query
+    """
+    # A missing key field only matches a document without that field.
+    return {field: (_canonical(document[field])
+                    if not _is_missing(document.get(field))
+                    else {'$exists': False})
+            for field in fields}
+
+
+def upsert(model, document, fields):
+    """
+    Replaces the document with the natural key of the given document
+    in a single atomic operation, or inserts it if there is no such
+    document. The original creation date is preserved.
+
+    :param model: the document class
+    :param document: the raw document
+    :param fields: the natural key fields
+    :return: the (written document, original document) tuple,
+        where the original is None if the document is inserted
+    """
+    query = natural_key(fields, document)
+    content = SON((k, v) for k, v in document.iteritems() if k != '_id')
+    _canonicalize(content, fields)
+    created = content.pop(config.DATE_CREATED, None) or datetime.utcnow()
+    on_insert = {'_id': ObjectId(), config.DATE_CREATED: created}
+    update = {'$set': content, '$setOnInsert': on_insert}
+    # A model field which is not in the document is removed, as in
+    # a PUT request.
+    unset = {field: '' for field in model._reverse_db_field_map
+             if field not in content and field not in on_insert}
+    if unset:
+        update['$unset'] = unset
+    collection = model._get_collection()
+    try:
+        original = collection.find_one_and_update(query, update, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent upsert inserted the document first. The retry
+        # matches that document.
+        original = collection.find_one_and_update(query, update, upsert=True)
+    written = dict(content)
+    if original:
+        written['_id'] = original['_id']
+        written[config.DATE_CREATED] = original.get(config.DATE_CREATED)
+    else:
+        written.update(on_insert)
+
+    return written, original
+
+
+def get_or_insert(model, content, fields):
+    """
+    Fetches the document with the given natural key content, or
+    inserts it if there is no such document, in a single atomic
+    operation.
+
+    :param model: the document class
+    :param content: the new document {field: value} content, which
+        can include the new document id (default is a new database id)
+    :param fields: the natural key fields
+    :return: the existing or new document
+    """
+    query = natural_key(fields, content)
+    son = model(**content).to_mongo()
+    _canonicalize(son, fields)
+    collection = model._get_collection()
+    update = {'$setOnInsert': son}
+    try:
+        raw = collection.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raw = collection.find_one(query)
+
+    return model._from_son(raw)
+
+
+def canonicalize_keys(model, fields):
+    """
+    Rewrites the stored natural keys whose dictionary items are not
+    in the sorted order which :meth:`natural_key` matches, and
+    removes the empty natural key values.
+
+    :param model: the document class
+    :param fields: the natural key fields
+    :return: the number of rewritten documents
+    """
+    # Read the keys as SON, which preserves the stored item order.
+    options = CodecOptions(document_class=SON)
+    collection = model._get_collection().with_options(codec_options=options)
+    projection = {field: 1 for field in fields}
+    requests = []
+    count = 0
+    for doc in collection.find({}, projection):
+        update = {}
+        for field in fields:
+            if field not in doc:
+                continue
+            # An empty key value is stored as a missing field.
+            if _is_missing(doc[field]):
+                update.setdefault('$unset', {})[field] = ''
+            elif _canonical(doc[field]) != doc[field]:
+                update.setdefault('$set', {})[field] = _canonical(doc[field])
+        if update:
+            requests.append(UpdateOne({'_id': doc['_id']}, update))
+        if len(requests) == BATCH_SIZE:
+            count += collection.bulk_write(requests).modified_count
+            requests = []
+    if requests:
+        count += collection.bulk_write(requests).modified_count
+
+    return count
+
+
+def _upsert_view(resource):
+    """
+    The :const:`UPSERT_URL` endpoint view.
+
+    :param resource: the Eve resource name
+    """
+    if resource not in NATURAL_KEYS:
+        abort(404)
+
+    return _upsert(resource)
+
+
+@ratelimit()
+@requires_auth('item')
+@pre_event
+def _upsert(resource, **lookup):
+    """
+    Upserts the request document.
+
+    :param resource: the Eve resource name
+    :param lookup: the unused Eve lookup
+    :return: the response
+    """
+    require_method(resource, 'item_methods', 'PUT')
+    require_method(resource, 'resource_methods', 'POST')
+    challenge = authorize(resource)
+    if challenge:
+        return challenge
+    fields = NATURAL_KEYS[resource]
+    document = payload()
+    if not isinstance(document, dict):
+        abort(400, description="The upsert payload is not a dictionary")
+    date_utc = datetime.utcnow().replace(microsecond=0)
+    try:
+        son = to_mongo(resource, document, date_utc)
+    except PayloadError as e:
+        response = {config.STATUS: config.STATUS_ERR,
+                    config.ISSUES: e.issues}
+        return send_response(None, (response, None, None, 400))
+    model = app.data.cls_map[resource]
+    written, original = upsert(model, son, fields)
+    if original:
+        getattr(app, 'on_replaced')(resource, written, original)
+        getattr(app, 'on_replaced_%s' % resource)(written, original)
+        code = 200
+    else:
+        getattr(app, 'on_inserted')(resource, [written])
+        getattr(app, 'on_inserted_%s' % resource)([written])
+        code = 201
+    response = {config.STATUS: config.STATUS_OK,
+                config.ID_FIELD: written['_id']}
+
+    return send_response(None, (response, None, None, code))
+
+
+def _canonicalize(document, fields):
+    """
+    Converts the given raw document natural key values to the stored
+    form. An empty key value is removed, so that it matches the
+    :meth:`natural_key` missing field query.
+
+    :param document: the raw document
+    :param fields: the natural key fields
+    """
+    for field in fields:
+        if field not in document:
+            continue
+        if _is_missing(document[field]):
+            del document[field]
+        else:
+            document[field] = _canonical(document[field])
+
+
+def _is_missing(value):
+    """
+    :param value: the natural key value
+    :return: whether the value is None or empty
+    """
+    return value is None or value == {} or value == []
+
+
+def _canonical(value):
+    """
+    :param value: the natural key value
+    :return: the equivalent value with the dictionary items in
+        sorted order
+    """
+    if isinstance(value, dict):
+        return SON((k, _canonical(v)) for k, v in sorted(value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+
+    return value
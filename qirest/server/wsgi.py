@@ -0,0 +1,17 @@
+"""
+The qirest WSGI application module for a production WSGI server,
+e.g.::
+
+    gunicorn --workers 4 qirest.server.wsgi:app
+
+:Note: each server worker process imports this module, and thus
+    opens its own database connection. The application must not be
+    preloaded in the WSGI server master process, since a MongoDB
+    client connection is not safe to share across a fork.
+"""
+
+import logging
+from qirest.server.run import (app, warn_missing_indexes)
+
+logging.basicConfig()
+warn_missing_indexes()
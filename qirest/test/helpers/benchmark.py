@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Compares the stock Eve and fast JSON renderer throughput on the
+seeded subject documents. The test database is seeded first if
+it has no subjects, e.g.::
+
+    ./qirest/test/helpers/benchmark.py --repeat 20
+"""
+
+import sys
+import time
+import argparse
+from eve import render as eve_render
+from qirest_client.model.subject import Subject
+from qirest.server import render
+from qirest.server.run import app
+from qirest.test.helpers import seed
+
+RENDERERS = [('stock', eve_render.render_json),
+             ('fast', render.render_fast_json)]
+"""The (name, render function) benchmark items."""
+
+
+def benchmark(repeat=10):
+    """
+    Renders the seeded subject documents with each of the
+    :const:`RENDERERS`.
+
+    :param repeat: the number of times to render the subjects
+    :return: the {renderer: (documents per second, megabytes per
+        second)} dictionary
+    """
+    if not Subject.objects.count():
+        seed.seed()
+    # The subject documents as the Eve data layer builds them.
+    docs = [dict(sbj.to_mongo()) for sbj in Subject.objects]
+    results = {}
+    with app.test_request_context():
+        for name, render_json in RENDERERS:
+            size = 0
+            start = time.time()
+            for _ in range(repeat):
+                for doc in docs:
+                    size += len(render_json(doc))
+            elapsed = time.time() - start
+            results[name] = (len(docs) * repeat / elapsed,
+                             size / elapsed / 1e6)
+
+    return results
+
+
+def main(argv=sys.argv):
+    # Parse the command line arguments.
+    opts = _parse_arguments()
+    if not render.ujson:
+        print("ujson is not installed; the fast renderer is the"
+              " stock renderer.")
+    results = benchmark(**opts)
+    for name, _ in RENDERERS:
+        docs_per_sec, mb_per_sec = results[name]
+        print("%-6s %10.1f subjects/s %8.2f MB/s" %
+              (name, docs_per_sec, mb_per_sec))
+
+
+def _parse_arguments():
+    """Parses the command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int,
+                        help="the number of times to render the subjects"
+                             " (default 10)")
+
+    args = vars(parser.parse_args())
+    nonempty_args = dict((k, v) for k, v in args.iteritems() if v != None)
+
+    return nonempty_args
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+The seed phase timing report.
+
+A :class:`PhaseReport` accumulates the wall time, document count,
+written bytes and Mongo round trips of each named phase. Phases
+nest. The time of a nested phase is not counted in the enclosing
+phase, so the phase times add up to the total time.
+"""
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from bson import BSON
+
+
+class PhaseReport(object):
+    """The per-phase timing and throughput accumulator."""
+
+    def __init__(self):
+        self.measure_size = False
+        """
+        Flag indicating whether to measure the written BSON size.
+        The measurement encodes each written document a second time,
+        so it is disabled by default.
+        """
+        self.reset()
+
+    def reset(self):
+        """Discards the recorded phases."""
+        self._phases = OrderedDict()
+        self._stack = []
+        self._start = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as the given phase, e.g.::
+
+            with report.phase('clear'):
+                ...
+
+        :param name: the phase name
+        """
+        now = time.time()
+        if self._stack:
+            # Pause the enclosing phase.
+            outer, start = self._stack[-1]
+            self._entry(outer)['seconds'] += now - start
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.time()
+            _, start = self._stack.pop()
+            self._entry(name)['seconds'] += now - start
+            if self._stack:
+                # Resume the enclosing phase.
+                self._stack[-1][1] = now
+
+    def record(self, name, documents=0, size=0, round_trips=0):
+        """
+        Adds the given counts to the phase.
+
+        :param name: the phase name
+        :param documents: the number of documents
+        :param size: the number of written bytes
+        :param round_trips: the number of Mongo round trips
+        """
+        entry = self._entry(name)
+        entry['documents'] += documents
+        entry['bytes'] += size
+        entry['round_trips'] += round_trips
+
+    def size(self, sons):
+        """
+        :param sons: the raw documents iterable
+        :return: the BSON size of the documents, or zero if
+            :attr:`measure_size` is not set
+        """
+        if not self.measure_size:
+            return 0
+        return sum(len(BSON.encode(son)) for son in sons)
+
+    def as_dict(self):
+        """
+        :return: the JSON-serializable report dictionary
+        """
+        phases = []
+        for name, entry in self._phases.iteritems():
+            item = OrderedDict([('phase', name)])
+            item.update(entry)
+            seconds = entry['seconds']
+            rate = entry['documents'] / seconds if seconds else None
+            item['documents_per_second'] = rate
+            phases.append(item)
+
+        return OrderedDict([('total_seconds', time.time() - self._start),
+                            ('phases', phases)])
+
+    def _entry(self, name):
+        entry = self._phases.get(name)
+        if entry is None:
+            entry = self._phases[name] = OrderedDict(
+                [('seconds', 0.0), ('documents', 0), ('bytes', 0),
+                 ('round_trips', 0)]
+            )
+
+        return entry
@@ -2,17 +2,25 @@
 import sys
 import os
 import re
+import gzip
+import json
+import struct
 import argparse
 from datetime import (datetime, timedelta)
 import pytz
 import random
-import math
+import hashlib
+import collections
+import multiprocessing
 from decimal import Decimal
+from uuid import UUID
+from bson import (BSON, ObjectId, SON)
+from bson.codec_options import CodecOptions
 from bunch import (Bunch, bunchify)
+from pymongo import UpdateOne
 from mongoengine import connect
-from qiutil import uid
+import numpy
 from qiutil.file import splitexts
-from qirest_client.helpers import database
 from qirest_client.model.subject import (Project, ImagingCollection, Subject)
 from qirest_client.model.imaging import (
   Session, SessionDetail, Modeling, Scan, Registration, Protocol,
@@ -26,7 +34,9 @@ from qirest_client.model.clinical import (
   ModifiedBloomRichardsonGrade, SarcomaPathology, FNCLCCGrade,
   NecrosisPercentValue, NecrosisPercentRange, necrosis_percent_as_score
 )
-from qirest.server import settings
+import qirest
+from qirest.server import (settings, indexes, protocols)
+from qirest.test.helpers.report import PhaseReport
 
 DEFAULT_PROJECT = 'QIN_Test'
 """The test/dev project name."""
@@ -40,14 +50,79 @@ CONNECT_SETTINGS = dict(
 )
 """The connection {parameter: constant} dictionary."""
 
+BULK_BATCH_SIZE = 1000
+"""The maximum number of documents in a bulk seed insert."""
+
+SUBJECT_COUNT = 32
+"""The default number of subjects per collection."""
+
+MIN_VISIT_COUNT = 2
+"""
+The minimum number of visits per subject. The mock treatments
+span the first and last visit.
+"""
+
+DETAIL_REFERENCE = 'encounters.detail'
+"""The subject session detail reference field path."""
+
+CLINICAL_FIELDS = ['birth_date', 'races', 'ethnicity', 'gender',
+                   'diagnosis_date', 'treatments']
+"""The subject clinical fields other than the clinical encounters."""
+
+REPORT = PhaseReport()
+"""
+The seed phase timing report. The seed phases are:
+
+* ``clear`` - removing the old seed content
+
+* ``protocols`` - the protocol lookup
+
+* ``generate`` - building the subject and session detail documents
+
+* ``detail_writes`` - writing the session details
+
+* ``subject_writes`` - writing the subjects
+
+* ``clinical`` - building the :meth:`mock_clinical` updates
+
+* ``clinical_writes`` - writing the :meth:`mock_clinical` updates
+"""
+
+SNAPSHOT_MODELS = [Project, ImagingCollection, Protocol, SessionDetail,
+                   Subject]
+"""The document classes whose collections are saved in a snapshot."""
+
+JOB_CHUNK_SIZE = 50
+"""The number of subjects generated by one parallel seed task."""
+
+MIN_VOLUME_COUNT = 8
+"""
+The minimum number of volumes per scan. The intensity curve peaks
+at most two volumes after the bolus arrival.
+"""
+
 
 class CollectionBuilder(object):
     """The abstract collection builder superclass."""
 
     def __init__(self, name, **opts):
         self.name = name
+        self.defaults = opts
         self.options = bunchify(opts)
 
+    def configure(self, **opts):
+        """
+        Overrides the default builder options, e.g.::
+
+            builder.configure(visit_count=6, volume_count=64)
+
+        An option which is omitted or None reverts to the default.
+
+        :param opts: the builder {option: value} overrides
+        """
+        overrides = {k: v for k, v in opts.iteritems() if v is not None}
+        self.options = bunchify(dict(self.defaults, **overrides))
+
     def choose_gender(self):
         """
         Returns a gender for this collection. The default is roughly
@@ -345,6 +420,15 @@ def builder_for(name):
 DATE_0 = datetime(2013, 1, 4, tzinfo=pytz.utc)
 """The first image acquisition date."""
 
+SEED_DATE = datetime(2016, 1, 4)
+"""
+The seeded document Eve creation and update date. The date is fixed,
+so that a reproducible seed run writes the same documents.
+"""
+
+EVE_DATE_FIELDS = ['created', 'updated']
+"""The date fields which Eve-Mongoengine adds to the document classes."""
+
 FXL_K_TRANS_AVG = 0.2
 """The average Standard Model Ktrans value."""
 
@@ -391,10 +475,28 @@ The following protocols:
 """
 
 
-def seed(project=None):
+def seed(project=None, bulk=False, subject_count=SUBJECT_COUNT,
+         visit_count=None, volume_count=None, jobs=1, random_seed=None):
     """
-    Populates the currently connected MongoDB database with three
-    subjects each of the :const:`COLLECTION_BUILDERS`.
+    Populates the currently connected MongoDB database with
+    *subject_count* subjects each of the :const:`COLLECTION_BUILDERS`.
+    The visit and volume counts default to the collection builder
+    options.
+
+    Each subject is generated from its own pseudo-random stream,
+    which is derived from the seed run and the subject secondary
+    key. If *jobs* is greater than one, then the subjects are
+    generated by that many worker processes and bulk inserted by
+    this process. The generated content does not depend on the
+    number of jobs. If the *random_seed* is set, then the generated
+    content is reproducible, including the database ids of the
+    project, collection, subject, session detail and new protocol
+    documents.
+
+    If the *bulk* flag is set, then the new session details and
+    subjects are built in memory and written with one batched insert
+    per :const:`BULK_BATCH_SIZE` documents rather than one save per
+    document.
 
     :Note: existing content which matches the seed content, including
       imaging collection objects, subjects and subject detail, is
@@ -404,111 +506,494 @@ def seed(project=None):
 
     :param project: the name of the project to seed
         (default ``QIN_TEST``)
-    :return: a list consisting of three *project* subjects for
-        each collection in :const:`COLLECTION_BUILDERS`
+    :param bulk: flag indicating whether to bulk insert the subjects
+    :param subject_count: the number of subjects per collection
+    :param visit_count: the number of visits per subject
+    :param volume_count: the number of volumes per scan
+    :param jobs: the number of subject generation processes
+    :param random_seed: the integer seed of a reproducible seed run
+        (default is a new seed for each run)
+    :return: a list consisting of *subject_count* *project* subjects
+        for each collection in :const:`COLLECTION_BUILDERS`
+    """
+    return list(seed_subjects(project, bulk=bulk, subject_count=subject_count,
+                              visit_count=visit_count,
+                              volume_count=volume_count, jobs=jobs,
+                              random_seed=random_seed))
+
+
+def seed_subjects(project=None, bulk=False, subject_count=SUBJECT_COUNT,
+                  visit_count=None, volume_count=None, jobs=1,
+                  random_seed=None):
+    """
+    The :meth:`seed` generator. The subjects are made lazily and
+    yielded as they are written. A bulk or parallel seed run writes
+    at most :const:`BULK_BATCH_SIZE` subjects at a time, so the
+    seed memory does not grow with the cohort size unless the
+    caller retains the yielded subjects.
+
+    The parameters are described in :meth:`seed`. The database
+    is not changed until the first subject is requested.
+
+    :yield: the seeded subjects
     """
     if not project:
         project = DEFAULT_PROJECT
+    # Make the secondary key indexes, if necessary.
+    indexes.create_indexes()
     # Clear out the old content, if any.
     clear(project)
-    # Initialize the pseudo-random generator.
-    random.seed()
+    # The seed from which the subject random streams are derived.
+    if random_seed is None:
+        random_seed = _new_random_seed()
     # Make the protocols.
-    PROTOCOLS.update(_create_protocols())
+    with REPORT.phase('protocols'):
+        round_trips = protocols.REGISTRY.round_trips
+        PROTOCOLS.update(_create_protocols(random_seed))
+        round_trips = protocols.REGISTRY.round_trips - round_trips
+        REPORT.record('protocols', documents=len(PROTOCOLS),
+                      round_trips=round_trips)
+    # Apply the cohort shape.
+    for builder in COLLECTION_BUILDERS:
+        builder.configure(visit_count=visit_count, volume_count=volume_count)
 
-    return _seed_project(project)
+    for sbj in _seed_project(project, bulk, subject_count, random_seed,
+                             jobs):
+        yield sbj
 
 
-def mock_clinical(project):
+def mock_clinical(project, random_seed=None):
     """
     Populates the currently connected MongoDB database subjects with
-    clinical data.
+    clinical data. Only the clinical fields are written, with partial
+    updates batched in bulk writes of :const:`BULK_BATCH_SIZE`
+    operations. The imaging sessions are not rewritten.
+
+    :param project: the project name
+    :param random_seed: the integer seed of a reproducible run
+        (default is a new seed for each run)
     """
-    # Initialize the pseudo-random generator.
-    random.seed()
+    if random_seed is None:
+        random_seed = _new_random_seed()
+    collection = Subject._get_collection()
+    requests = []
     # The existing subjects.
-    sbjs = Subject.objects(project=project)
+    sbjs = Subject.objects(project=project).no_dereference()
     for sbj in sbjs:
-        # Clear the existing clinical data.
-        cln = list(sbj.clinical_encounters)
-        if cln:
-            sbj.encounters = list(sbj.sessions)
-        # Add the new clinical data.
-        _add_mock_clinical(sbj)
-        sbj.save()
+        # Each subject has its own random stream.
+        random.seed(_subject_random_seed(random_seed, project,
+                                         sbj.collection, sbj.number))
+        with REPORT.phase('clinical'):
+            requests.extend(_clinical_updates(sbj))
+            REPORT.record('clinical', documents=1)
+        if len(requests) >= BULK_BATCH_SIZE:
+            _write_clinical_updates(collection, requests)
+            requests = []
+    if requests:
+        _write_clinical_updates(collection, requests)
+
+
+def _write_clinical_updates(collection, requests):
+    """
+    :param collection: the subject collection
+    :param requests: the :meth:`_clinical_updates` operations
+    """
+    with REPORT.phase('clinical_writes'):
+        collection.bulk_write(requests)
+        REPORT.record('clinical_writes', documents=len(requests),
+                      round_trips=1)
+
+
+def _clinical_updates(subject):
+    """
+    Replaces the given subject clinical data with new mock clinical
+    data.
+
+    The clinical encounters follow the imaging sessions in the
+    seeded subject encounters. In that case, the old clinical
+    encounters are sliced off and the new clinical encounters are
+    appended. Otherwise, all of the encounters are set.
+
+    :param subject: the subject to update
+    :return: the subject update operations
+    """
+    sessions = list(subject.sessions)
+    session_cnt = len(sessions)
+    is_prefix = all(isinstance(enc, Session)
+                    for enc in subject.encounters[:session_cnt])
+    # Clear the existing clinical data.
+    subject.encounters = sessions
+    # Add the new clinical data.
+    _add_mock_clinical(subject)
+    subject.validate()
+
+    # The changed fields.
+    raw = subject.to_mongo()
+    changed = {}
+    removed = {}
+    for attr in CLINICAL_FIELDS:
+        field = Subject._fields[attr].db_field
+        if field in raw:
+            changed[field] = raw[field]
+        else:
+            removed[field] = ''
+    enc_field = Subject._fields['encounters'].db_field
+    key = {'_id': subject.id}
+    ops = []
+    if is_prefix:
+        # Truncate the encounters to the sessions, then append the
+        # clinical encounters in a second update, since the same
+        # field cannot be modified twice in one update.
+        truncate = {enc_field: {'$each': [], '$slice': session_cnt}}
+        ops.append(UpdateOne(key, {'$push': truncate}))
+        clinical = raw[enc_field][session_cnt:]
+        update = {'$push': {enc_field: {'$each': clinical}}}
+    else:
+        changed[enc_field] = raw[enc_field]
+        update = {}
+    update['$set'] = changed
+    if removed:
+        update['$unset'] = removed
+    ops.append(UpdateOne(key, update))
+    # The truncation is small, so only the update size is counted.
+    REPORT.record('clinical_writes', size=REPORT.size([update]))
+
+    return ops
 
 
 def clear(project):
-    """Removes the seeded documents."""
-    for coll in COLLECTION_BUILDERS:
-        _clear_collection(project, coll.name)
-    try:
-        prj = Project.objects.get(name=project)
-        prj.delete()
-    except Project.DoesNotExist:
-        pass
+    """
+    Removes the project documents, including the session details
+    which the project subjects reference. The documents are removed
+    with a few bulk deletes rather than one delete per document.
+
+    :param project: the seeded project name
+    """
+    sbj_filter = dict(project=project)
+    with REPORT.phase('clear'):
+        # Delete the referenced session details before the subjects,
+        # so that an interrupted clear can be rerun.
+        sbj_coll = Subject._get_collection()
+        cursor = sbj_coll.find(sbj_filter, {DETAIL_REFERENCE: 1})
+        cursor.batch_size(BULK_BATCH_SIZE)
+        detail_ids = list(_referenced_detail_ids(cursor))
+        count = _delete_ids(SessionDetail, detail_ids)
+        # The subject scan query and getMore requests. The last
+        # getMore of an exact multiple of the batch size is empty.
+        scan_cnt = cursor.retrieved // BULK_BATCH_SIZE + 1
+        # The detail delete batches.
+        batch_cnt = -(-len(detail_ids) // BULK_BATCH_SIZE)
+        result = sbj_coll.delete_many(sbj_filter)
+        count += result.deleted_count
+        ImagingCollection._get_collection().delete_many(dict(project=project))
+        Project._get_collection().delete_many(dict(name=project))
+        # The scan, the detail batches and three deletes.
+        REPORT.record('clear', documents=count,
+                      round_trips=scan_cnt + batch_cnt + 3)
+
+
+def sweep_orphans():
+    """
+    Removes the session details which are not referenced by any
+    subject, e.g. the details left over by a clear which did not
+    cascade. The session details are checked in batches of
+    :const:`BULK_BATCH_SIZE` against the subject session detail
+    reference index.
+
+    :return: the number of removed session details
+    """
+    sbj_coll = Subject._get_collection()
+    detail_coll = SessionDetail._get_collection()
+    orphans = []
+    count = 0
+    cursor = detail_coll.find({}, {'_id': 1})
+    for batch in _batches(doc['_id'] for doc in cursor):
+        query = {DETAIL_REFERENCE: {'$in': batch}}
+        refs = sbj_coll.find(query, {DETAIL_REFERENCE: 1})
+        referenced = set(_referenced_detail_ids(refs))
+        orphans.extend(oid for oid in batch if oid not in referenced)
+        if len(orphans) >= BULK_BATCH_SIZE:
+            count += _delete_ids(SessionDetail, orphans)
+            orphans = []
+    count += _delete_ids(SessionDetail, orphans)
+
+    return count
+
+
+def snapshot(path):
+    """
+    Saves the :const:`SNAPSHOT_MODELS` collections of the currently
+    connected MongoDB database to the given gzip-compressed BSON
+    fixture file. Each fixture record is a BSON
+    ``{collection, document}`` item.
+
+    :param path: the fixture file path
+    :return: the number of saved documents
+    """
+    # The fetched documents preserve the field order.
+    options = CodecOptions(document_class=SON)
+    count = 0
+    with gzip.open(path, 'wb') as f:
+        for klass in SNAPSHOT_MODELS:
+            collection = klass._get_collection()
+            for doc in collection.with_options(codec_options=options).find():
+                record = SON([('collection', collection.name),
+                              ('document', doc)])
+                f.write(BSON.encode(record))
+                count += 1
+
+    return count
+
+
+def restore(path):
+    """
+    Replaces the :const:`SNAPSHOT_MODELS` collections of the currently
+    connected MongoDB database with the content of the given
+    :meth:`snapshot` fixture file. The documents are inserted in
+    batches of :const:`BULK_BATCH_SIZE`.
+
+    :param path: the fixture file path
+    :return: the number of restored documents
+    """
+    indexes.create_indexes()
+    collections = {klass._get_collection().name: klass._get_collection()
+                   for klass in SNAPSHOT_MODELS}
+    for collection in collections.itervalues():
+        collection.delete_many({})
+    count = 0
+    name = None
+    batch = []
+    for record in _read_snapshot(path):
+        if record['collection'] != name or len(batch) == BULK_BATCH_SIZE:
+            if batch:
+                collections[name].insert_many(batch)
+                count += len(batch)
+            name = record['collection']
+            batch = []
+        batch.append(record['document'])
+    if batch:
+        collections[name].insert_many(batch)
+        count += len(batch)
+    # The cached protocols are no longer valid.
+    protocols.REGISTRY.invalidate()
+
+    return count
+
+
+def _read_snapshot(path):
+    """
+    :param path: the :meth:`snapshot` fixture file path
+    :yield: the fixture records
+    """
+    # The decoded documents preserve the field order.
+    options = CodecOptions(document_class=SON)
+    with gzip.open(path, 'rb') as f:
+        while True:
+            prefix = f.read(4)
+            if not prefix:
+                break
+            size = struct.unpack('<i', prefix)[0]
+            data = prefix + f.read(size - 4)
+            yield BSON(data).decode(codec_options=options)
+
+
+def _referenced_detail_ids(subjects):
+    """
+    :param subjects: the raw subject documents
+    :yield: the session detail ids referenced by the subjects
+    """
+    for sbj in subjects:
+        for enc in sbj.get('encounters', []):
+            detail = enc.get('detail')
+            if detail:
+                yield detail
 
 
-def _seed_project(project):
+def _delete_ids(klass, oids):
+    """
+    Deletes the given documents in batches of :const:`BULK_BATCH_SIZE`.
+
+    :param klass: the document class
+    :param oids: the ids of the documents to delete
+    :return: the number of deleted documents
+    """
+    collection = klass._get_collection()
+    count = 0
+    for batch in _batches(oids):
+        result = collection.delete_many({'_id': {'$in': batch}})
+        count += result.deleted_count
+
+    return count
+
+
+def _batches(items):
+    """
+    :param items: the items iterable
+    :yield: the :const:`BULK_BATCH_SIZE` item lists
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == BULK_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _seed_project(project, bulk=False, subject_count=SUBJECT_COUNT,
+                  random_seed=None, jobs=1):
+    """
+    :return: the lazy project subjects iterator
+    """
     # Make the project database object.
-    prj = Project(name=project, description='Test project')
-    prj.save()
+    prj = Project(id=_seed_object_id(random_seed, project),
+                  name=project, description='Test project',
+                  **_seed_dates(Project))
+    _insert(prj)
     # Make the collections.
-    # Note: itertools chain on a generator is preferable to iterate over
-    # the collections. This works in python 1.7.1, but not python 1.7.2.
-    # The work-around is to build up the subject collection in the for
-    # loop below.
-    subjects = []
-    for builder in COLLECTION_BUILDERS:
-        subjects.extend(_seed_collection(project, builder))
+    if jobs > 1:
+        subjects = _seed_project_parallel(project, subject_count,
+                                          random_seed, jobs)
+    else:
+        subjects = _seed_collections(project, bulk, subject_count,
+                                     random_seed)
+        if bulk:
+            subjects = _insert_subjects(subjects)
+
     return subjects
 
 
-def _seed_collection(project, builder):
-    # Make the collection database object.
-    opts = {attr: val for attr, val in builder.options.iteritems()
-            if attr in ImagingCollection._fields}
-    collection = ImagingCollection(project=project,
-                                   name=builder.name,
-                                   **opts)
-    collection.save()
-    # Make and return the subjects.
-    return [_seed_subject(project, builder, sbj_nbr)
-            for sbj_nbr in range(1, 33)]
-
-
-def _clear_collection(project, collection):
-    for sbj_nbr in range(1, 33):
-        try:
-            sbj = Subject.objects.get(number=sbj_nbr, project=project,
-                                      collection=collection)
-            sbj.delete()
-        except Subject.DoesNotExist:
-            pass
-    try:
-        coll = ImagingCollection.objects.get(name=collection)
-        coll.delete()
-    except ImagingCollection.DoesNotExist:
-        pass
+def _seed_collections(project, bulk, subject_count, random_seed):
+    """
+    :yield: the :const:`COLLECTION_BUILDERS` subjects
+    """
+    for builder in COLLECTION_BUILDERS:
+        for sbj in _seed_collection(project, builder, bulk, subject_count,
+                                    random_seed):
+            yield sbj
 
 
-def _seed_subject(project, builder, subject_number):
+def _seed_project_parallel(project, subject_count, random_seed, jobs):
     """
-    If the given subject is already in the database, then the
-    subject is ignored. Otherwise, a new subject is created
-    and populated with detail information.
+    Generates the new project subjects in *jobs* worker processes.
+    Each task generates :const:`JOB_CHUNK_SIZE` subjects and returns
+    the raw subject and session detail documents, which are inserted
+    in batches as the tasks complete. At most two tasks per job are
+    outstanding at a time.
 
-    :param builder: the subject collection builder
-    :param subject_number: the subject number
-    :return: the subject with the given collection and number
+    :yield: the project subjects
     """
+    tasks = []
+    for builder in COLLECTION_BUILDERS:
+        _save_collection(project, builder, random_seed)
+        sbj_nbrs = range(1, subject_count + 1)
+        for start in range(0, len(sbj_nbrs), JOB_CHUNK_SIZE):
+            chunk = sbj_nbrs[start:start + JOB_CHUNK_SIZE]
+            tasks.append((project, builder.name, chunk, random_seed))
+    # The workers start with the protocols and cohort shape of
+    # this process.
+    options = {builder.name: dict(builder.options)
+               for builder in COLLECTION_BUILDERS}
+    pool = multiprocessing.Pool(jobs, initializer=_init_seed_worker,
+                                initargs=(dict(PROTOCOLS), options))
+    pending = collections.deque()
     try:
-        sbj = Subject.objects.get(number=subject_number, project=project,
-                                  collection=builder.name)
-    except Subject.DoesNotExist:
-        sbj = _create_subject(project, builder, subject_number)
+        for task in tasks:
+            pending.append(pool.apply_async(_generate_subjects, (task,)))
+            if len(pending) >= 2 * jobs:
+                for sbj in _insert_generated(pending.popleft()):
+                    yield sbj
+        while pending:
+            for sbj in _insert_generated(pending.popleft()):
+                yield sbj
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _insert_generated(pending):
+    """
+    Inserts the given :meth:`_generate_subjects` result.
+
+    :param pending: the (raw subject, raw session details) tuples
+        asynchronous result
+    :return: the inserted subjects
+    """
+    # The wait for the worker process is the parent generate time.
+    with REPORT.phase('generate'):
+        generated = pending.get()
+        doc_cnt = sum(1 + len(sons) for _, sons in generated)
+        REPORT.record('generate', documents=doc_cnt)
+    sbj_sons = [sbj_son for sbj_son, _ in generated]
+    detail_sons = [son for _, sons in generated for son in sons]
+    _insert_batches(SessionDetail, detail_sons)
+    _insert_batches(Subject, sbj_sons)
+
+    return [Subject._from_son(son) for son in sbj_sons]
+
+
+def _init_seed_worker(protocols, options):
+    """
+    Initializes a parallel seed worker process.
+
+    :param protocols: the :const:`PROTOCOLS` content
+    :param options: the {collection: builder options} dictionary
+    """
+    PROTOCOLS.update(protocols)
+    for name, opts in options.iteritems():
+        builder_for(name).options = bunchify(opts)
+
+
+def _generate_subjects(task):
+    """
+    Generates the given subjects in a parallel seed worker process.
+
+    :param task: the (project, collection, subject numbers,
+        random seed) tuple
+    :return: the (raw subject, raw session details) tuple for
+        each new subject
+    """
+    project, collection, sbj_nbrs, random_seed = task
+    builder = builder_for(collection)
+    generated = []
+    for sbj_nbr in sbj_nbrs:
+        sbj = _create_subject(project, builder, sbj_nbr, bulk=True,
+                              random_seed=random_seed)
+        details = [sess.detail for sess in sbj.sessions]
+        for doc in details + [sbj]:
+            doc.validate()
+        generated.append((sbj.to_mongo(),
+                          [detail.to_mongo() for detail in details]))
+
+    return generated
+
+
+def _seed_collection(project, builder, bulk=False,
+                     subject_count=SUBJECT_COUNT, random_seed=None):
+    """
+    :yield: the new collection subjects
+    """
+    _save_collection(project, builder, random_seed)
+    # Make the subjects.
+    for sbj_nbr in range(1, subject_count + 1):
+        yield _create_subject(project, builder, sbj_nbr, bulk=bulk,
+                              random_seed=random_seed)
+
 
-    return sbj
+def _save_collection(project, builder, random_seed):
+    # Make the collection database object.
+    opts = {attr: val for attr, val in builder.options.iteritems()
+            if attr in ImagingCollection._fields}
+    opts.update(_seed_dates(ImagingCollection))
+    oid = _seed_object_id(random_seed, project, builder.name)
+    collection = ImagingCollection(id=oid, project=project,
+                                   name=builder.name,
+                                   **opts)
+    _insert(collection)
 
 
 ETHNICITY_INCIDENCE = [15, 85]
@@ -523,41 +1008,248 @@ The rough US race incidence for the respective race choices.
 The incidences sum to 100.
 """
 
-def _create_protocols():
-    """Returns the protocols described in :const:`PROTOCOLS`."""
+def _create_protocols(random_seed):
+    """
+    Returns the protocols described in :const:`PROTOCOLS`. The
+    protocols are obtained from the cached protocol registry.
+
+    :param random_seed: the seed run random seed from which the
+        new protocol ids are derived
+    """
+    registry = protocols.REGISTRY
+
+    def get_or_create(technique, configuration=None):
+        oid = _seed_object_id(random_seed, technique)
+        return registry.get_or_create(technique, configuration, id=oid,
+                                      **_seed_dates(Protocol))
+
     # The modeling protocol.
-    mdl_key = dict(technique='BOLERO', configuration=dict(r1=R1_PARAMS))
-    bolero = database.get_or_create(Protocol, mdl_key)
+    bolero = get_or_create('BOLERO', dict(r1=R1_PARAMS))
     # The T1 scan protocol.
-    t1 = database.get_or_create(Protocol, dict(technique='T1'))
+    t1 = get_or_create('T1')
     # The T2 scan protocol.
-    t2 = database.get_or_create(Protocol, dict(technique='T2'))
+    t2 = get_or_create('T2')
     # The registration protocol.
-    ants_cfg = {'Registration': REG_PARAMS}
-    ants_key = dict(technique='ANTs', configuration=ants_cfg)
-    ants = database.get_or_create(Protocol, ants_key)
+    ants = get_or_create('ANTs', {'Registration': REG_PARAMS})
 
     return dict(t1=t1, t2=t2, bolero=bolero, ants=ants)
 
 
-def _create_subject(project, builder, subject_number):
+def _create_subject(project, builder, subject_number, bulk=False,
+                    random_seed=None):
+    """
+    :param project: the subject project name
+    :param builder: the subject collection builder
+    :param subject_number: the subject number
+    :param bulk: flag indicating whether to defer saving the subject
+        and session details to :meth:`_insert_subjects`
+    :param random_seed: the seed run random seed from which the
+        subject random stream is derived (default is to continue
+        the current stream)
+    :return: the new subject
+    """
+    with REPORT.phase('generate'):
+        subject = _build_subject(project, builder, subject_number, bulk,
+                                 random_seed)
+        # The subject and its session details.
+        doc_cnt = 1 + builder.options.visit_count
+        REPORT.record('generate', documents=doc_cnt)
+        # Save the subject.
+        if not bulk:
+            _save(subject, 'subject_writes')
+
+    return subject
+
+
+def _build_subject(project, builder, subject_number, bulk, random_seed):
+    """
+    The :meth:`_create_subject` document builder.
+
+    :return: the new subject
+    """
+    if random_seed is not None:
+        random.seed(_subject_random_seed(random_seed, project, builder.name,
+                                         subject_number))
     # The subject with just a secondary key.
-    subject = Subject(project=project, collection=builder.name,
-                      number=subject_number)
+    subject = Subject(id=_generate_object_id(), project=project,
+                      collection=builder.name, number=subject_number,
+                      **_seed_dates(Subject))
 
+    # The intensity curves of all of the sessions are made at once.
+    visit_cnt = builder.options.visit_count
+    curves = _create_session_curves(builder, visit_cnt)
     # Start with the MR sessions.
-    subject.encounters = [_create_session(builder, subject, i + 1)
-                          for i in range(builder.options.visit_count)]
+    subject.encounters = [_create_session(builder, subject, i + 1, bulk,
+                                          curves[i])
+                          for i in range(visit_cnt)]
 
     # Fabricate the clinical data.
     _add_mock_clinical(subject)
 
-    # Save the subject.
-    subject.save()
-
     return subject
 
 
+def _save(doc, phase):
+    """
+    Saves the given new document as part of the given report phase.
+
+    :param doc: the document to save
+    :param phase: the :const:`REPORT` phase
+    """
+    with REPORT.phase(phase):
+        _insert(doc)
+        size = REPORT.size([doc.to_mongo()]) if REPORT.measure_size else 0
+        REPORT.record(phase, documents=1, size=size, round_trips=1)
+
+
+def _insert(doc):
+    """
+    Inserts the given new document. Unlike the MongoEngine save, the
+    insert does not reset the Eve update date.
+
+    :param doc: the document to insert
+    """
+    doc.validate()
+    oid = doc._get_collection().insert_one(doc.to_mongo()).inserted_id
+    _mark_saved(doc, oid)
+
+
+def _mark_saved(doc, oid):
+    """
+    Marks the given inserted document as saved, as in the MongoEngine
+    save.
+
+    :param doc: the inserted document
+    :param oid: the document database id
+    """
+    doc.id = oid
+    doc._created = False
+    doc._clear_changed_fields()
+
+
+def _seed_dates(klass):
+    """
+    :param klass: the document class
+    :return: the {field: :const:`SEED_DATE`} dictionary of the
+        :const:`EVE_DATE_FIELDS` which the document class has
+    """
+    return {field: SEED_DATE for field in EVE_DATE_FIELDS
+            if field in klass._fields}
+
+
+def _seed_object_id(random_seed, *key):
+    """
+    :param random_seed: the seed run random seed
+    :param key: the document key values
+    :return: the document database id derived from the seed and key
+    """
+    key = ':'.join([str(random_seed)] + list(key))
+
+    return ObjectId(hashlib.sha256(key).hexdigest()[:24])
+
+
+def _new_random_seed():
+    """
+    :return: a new random seed for an unreproducible seed run
+    """
+    # Initialize the pseudo-random generator from the system source.
+    random.seed()
+
+    return random.getrandbits(64)
+
+
+def _subject_random_seed(random_seed, project, collection, subject_number):
+    """
+    :param random_seed: the seed run random seed
+    :param project: the subject project name
+    :param collection: the subject collection name
+    :param subject_number: the subject number
+    :return: the subject random stream seed
+    """
+    key = "%d:%s:%s:%d" % (random_seed, project, collection, subject_number)
+
+    return int(hashlib.sha256(key).hexdigest(), 16)
+
+
+def _insert_subjects(subjects):
+    """
+    Inserts the given unsaved subjects and their session details in
+    batches of :const:`BULK_BATCH_SIZE` subjects. The session details
+    are inserted first, since the subject sessions reference them.
+
+    :param subjects: the subjects iterable
+    :yield: the given subjects, as they are written
+    """
+    batch = []
+    for sbj in subjects:
+        batch.append(sbj)
+        if len(batch) == BULK_BATCH_SIZE:
+            for saved in _insert_subject_batch(batch):
+                yield saved
+            batch = []
+    for saved in _insert_subject_batch(batch):
+        yield saved
+
+
+def _insert_subject_batch(subjects):
+    """
+    :param subjects: the subjects to insert
+    :return: the given subjects
+    """
+    details = [sess.detail for sbj in subjects for sess in sbj.sessions]
+    _bulk_insert(SessionDetail, details)
+    _bulk_insert(Subject, subjects)
+
+    return subjects
+
+
+def _bulk_insert(klass, docs):
+    """
+    Validates and inserts the given new documents in batches of
+    :const:`BULK_BATCH_SIZE`.
+
+    :param klass: the document class
+    :param docs: the documents to insert
+    """
+    with REPORT.phase(_write_phase(klass)):
+        for doc in docs:
+            doc.validate()
+        sons = [doc.to_mongo() for doc in docs]
+    oids = _insert_batches(klass, sons)
+    for doc, oid in zip(docs, oids):
+        _mark_saved(doc, oid)
+
+
+def _insert_batches(klass, sons):
+    """
+    Inserts the given raw documents in batches of
+    :const:`BULK_BATCH_SIZE`.
+
+    :param klass: the document class
+    :param sons: the raw documents to insert
+    :return: the inserted document ids
+    """
+    collection = klass._get_collection()
+    phase = _write_phase(klass)
+    oids = []
+    for start in range(0, len(sons), BULK_BATCH_SIZE):
+        batch = sons[start:start + BULK_BATCH_SIZE]
+        with REPORT.phase(phase):
+            oids.extend(collection.insert_many(batch).inserted_ids)
+            REPORT.record(phase, documents=len(batch), round_trips=1,
+                          size=REPORT.size(batch))
+
+    return oids
+
+
+def _write_phase(klass):
+    """
+    :param klass: the written document class
+    :return: the :const:`REPORT` phase name
+    """
+    return 'detail_writes' if klass is SessionDetail else 'subject_writes'
+
+
 def _add_mock_clinical(subject):
     """
     Adds clinical data to the given subject.
@@ -723,13 +1415,22 @@ TAU_I_FILE_NAME = 'tau_i_trans.nii.gz'
 COLOR_TABLE_FILE_NAME = '/etc/jet_colors.txt'
 
 
-def _create_session(builder, subject, session_number):
+def _create_session(builder, subject, session_number, bulk=False,
+                    curves=None):
     """
     Returns a new Session object whose detail includes the following:
     * a T1 scan with a registration
     * a T2 scan
     * a modeling result for the registration
+
+    If the *bulk* flag is set, then the session detail is not saved.
+    Instead, the detail is inserted later by :meth:`_insert_subjects`.
+
+    The session *curves* are made by :meth:`_create_session_curves`,
+    if necessary.
     """
+    if not curves:
+        curves = _create_session_curves(builder, 1)[0]
     # Stagger the inter-session duration.
     date = _create_session_date(subject, session_number)
 
@@ -747,10 +1448,13 @@ def _create_session(builder, subject, session_number):
     )
 
     # Make the session detail.
-    detail = _create_session_detail(builder, subject, session_number)
+    detail = _create_session_detail(builder, subject, session_number,
+                                    curves)
     # Save the detail first, since it is not embedded and we need to
-    # set the detail reference to make the session.
-    detail.save()
+    # set the detail reference to make the session. A bulk detail
+    # only needs the id for the reference.
+    if not bulk:
+        _save(detail, 'detail_writes')
     # The embedded session modeling objects.
     modelings = _create_modeling(subject, session_number)
 
@@ -759,27 +1463,28 @@ def _create_session(builder, subject, session_number):
                    detail=detail)
 
 
-def _create_session_detail(builder, subject, session_number):
+def _create_session_detail(builder, subject, session_number, curves):
     """
     Returns a new SessionDetail object which includes the following:
     * a T1 scan with a registration
     * a T2 scan
     * a modeling result for the registration
+
+    :param curves: the :meth:`_create_session_curves` item
     """
-    # The bolus arrival.
-    arv = int(round((0.5 - random.random()) * 4)) + AVG_BOLUS_ARRIVAL_NDX
     # Make the scans.
-    t1 = _create_t1_scan(builder, subject, session_number, arv)
+    t1 = _create_t1_scan(builder, subject, session_number, curves)
     t2 = _create_t2_scan(subject, session_number)
     scans = [t1, t2]
 
     # Return the session detail.
-    return SessionDetail(scans=scans)
+    return SessionDetail(id=_generate_object_id(), scans=scans,
+                         **_seed_dates(SessionDetail))
 
 
 def _create_modeling(subject, session_number):
     # The modeling resource name.
-    resource = "pk_%s" % uid.generate_string_uid()
+    resource = "pk_%s" % _generate_string_uid()
 
     # Add modeling parameters with a random offset.
     factor = 1 + ((random.random() - 0.5) * 0.4)
@@ -835,24 +1540,54 @@ SESSION_OFFSET_RANGES = dict(
 )
 """
 The range of offsets from the initial date for the breast scan dates.
+A later session continues at the interval between the last two
+ranges.
 """
 
 
 def _create_session_date(subject, session_number):
-    date_range = SESSION_OFFSET_RANGES[subject.collection][session_number - 1]
+    ranges = SESSION_OFFSET_RANGES[subject.collection]
+    if session_number > len(ranges):
+        (prev_low, _), (low, high) = ranges[-2:]
+        shift = (session_number - len(ranges)) * (low - prev_low)
+        date_range = (low + shift, high + shift)
+    else:
+        date_range = ranges[session_number - 1]
     offset = _random_int(*date_range)
     return DATE_0 + timedelta(days=offset)
 
 
-def _create_t1_scan(builder, subject, session_number, bolus_arrival_index):
+def _create_session_curves(builder, count):
+    """
+    Makes the bolus arrival and intensity curves of the given number
+    of sessions in one call. The scan curve has a motion artifact,
+    the registration curve does not.
+
+    :param builder: the subject collection builder
+    :param count: the number of sessions
+    :return: the session {bolus_arrival_index, scan, registration}
+        bunches
+    """
+    vol_cnt = builder.options.volume_count
+    arrivals = [int(round((0.5 - random.random()) * 4)) +
+                AVG_BOLUS_ARRIVAL_NDX for _ in range(count)]
+    motion_artifacts = [True] * count + [False] * count
+    curves = _create_intensity_curves(vol_cnt, arrivals + arrivals,
+                                      motion_artifacts)
+
+    return [Bunch(bolus_arrival_index=arv, scan=curves[i],
+                  registration=curves[count + i])
+            for i, arv in enumerate(arrivals)]
+
+
+def _create_t1_scan(builder, subject, session_number, curves):
     # The number of test volumes to create.
     vol_cnt = builder.options.volume_count
     # Make the volume image filenames.
     filenames = [_volume_basename(i+1) for i in range(vol_cnt)]
-    # Make the average intensity values.
-    intensities = _create_intensities(vol_cnt, bolus_arrival_index)
-    # Add a motion artifact.
-    _add_motion_artifact(intensities)
+    # The average intensity values.
+    intensities = curves.scan
+    bolus_arrival_index = curves.bolus_arrival_index
 
     # The common scan parameters contain only the voxel dimensions
     # and a few simple settings for test purposes. In practice,
@@ -883,7 +1618,7 @@ def _create_t1_scan(builder, subject, session_number, bolus_arrival_index):
 
     # Make the T1 registration.
     reg = _create_registration(builder, subject, session_number,
-                               bolus_arrival_index)
+                               curves.registration)
 
     return Scan(number=1, protocol=PROTOCOLS.t1, volumes=volumes,
                 time_series=time_series, registrations=[reg],
@@ -912,16 +1647,13 @@ def _create_t2_scan(subject, session_number):
     return Scan(number=2, protocol=PROTOCOLS.t2, volumes=volumes)
 
 
-def _create_registration(builder, subject, session_number,
-                         bolus_arrival_index):
+def _create_registration(builder, subject, session_number, intensities):
     # The number of test volumes to create.
     vol_cnt = builder.options.volume_count
     # The XNAT resource name.
-    resource = "reg_%s" % uid.generate_string_uid()
+    resource = "reg_%s" % _generate_string_uid()
     # Make the volume image file base names.
     filenames = [_volume_basename(i+1) for i in range(vol_cnt)]
-    # Make the average intensity values.
-    intensities = _create_intensities(vol_cnt, bolus_arrival_index)
     # Make the 3D volume images.
     reg_images = [Image(name=filenames[i],
                         metadata=dict(average_intensity=intensities[i]))
@@ -960,40 +1692,61 @@ def _create_label_map(modeling_file):
     return LabelMap(name=label_map, color_table=COLOR_TABLE_FILE_NAME)
 
 
-def _create_intensities(count, bolus_arrival_index):
+def _create_intensity_curves(count, bolus_arrival_indexes,
+                             motion_artifacts):
     """
+    Makes one intensity curve per bolus arrival. The curves are
+    computed together as array rows.
+
     :param count: the number of time points
-    :param bolus_arrival_index: the bolus arrival volume index
-    :return: the intensities array
+    :param bolus_arrival_indexes: the bolus arrival volume indexes
+    :param motion_artifacts: the flags indicating whether to add a
+        motion artifact to the respective curve
+    :return: the intensity lists
     """
-    # Ramp intensity up logarithmically (+ or - up to 5) until two time
-    # points after bolus arrival.
-    top = bolus_arrival_index + 2
-    intensities = [(math.log(i + 1) * 20) + (random.random() * 5)
-                   for i in range(top + 1)]
-    top_intensity = intensities[top]
-
+    # The NumPy generator draws from the current random stream, so
+    # a seeded run is reproducible.
+    rng = numpy.random.RandomState(random.getrandbits(32))
+    shape = (len(bolus_arrival_indexes), count)
+    ndx = numpy.arange(count)
+    # The peak is two time points after bolus arrival.
+    top = numpy.array(bolus_arrival_indexes)[:, numpy.newaxis] + 2
+    noise = rng.random_sample(shape) * 5
+    # Ramp intensity up logarithmically until the peak.
+    ramp = (numpy.log(ndx + 1) * 20) + noise
+    rows = numpy.arange(shape[0])
+    top_intensity = ramp[rows, top[:, 0]][:, numpy.newaxis]
     # Tail intensity off inverse exponentially thereafter.
-    for i in range(count - top - 1):
-        # A negative exponential declining factor.
-        factor = math.exp(-2 * (float(i + 1)/25))
-        # The signal intensity.
-        intensity = (factor * top_intensity) + (random.random() * 5)
-        intensities.append(intensity)
+    factor = numpy.exp(-2 * (ndx - top) / 25.0)
+    tail = (factor * top_intensity) + noise
+    curves = numpy.where(ndx <= top, ramp, tail)
+
+    # Skew five values roughly halfway into the sequence downward.
+    motion = numpy.array(motion_artifacts)
+    offset = numpy.rint(rng.uniform(-2, 2, shape[0]))
+    start = ((count // 2) + offset)[:, numpy.newaxis]
+    blip = (ndx >= start) & (ndx < start + 5) & motion[:, numpy.newaxis]
+    curves -= numpy.where(blip, rng.random_sample(shape) * 8, 0)
+
+    return curves.tolist()
 
-    return intensities
+
+def _generate_object_id():
+    """
+    :return: a database id from the current random stream
+    """
+    return ObjectId('%024x' % random.getrandbits(96))
 
 
-def _add_motion_artifact(intensities):
+def _generate_string_uid():
     """
-    Introduces a blip in the given intensity values. Five intensity values
-    roughly halfway into the sequence are skewed slightly downward.
+    Makes a unique resource name suffix from the current random
+    stream. Unlike a :mod:`qiutil.uid` identifier, the suffix is
+    reproduced by a seed run with the same random seed.
 
-    :param intensities: the intensity values
+    :return: the random UUID hex string
     """
-    start = int(len(intensities) / 2) + _random_int(-2, 2)
-    for i in range(start, start + 5):
-        intensities[i] -= random.random() * 8
+    return UUID(int=random.getrandbits(128), version=4).hex
 
 
 def _random_int(low, high):
@@ -1046,14 +1799,77 @@ def main(argv=sys.argv):
     opts = _parse_arguments()
     # Connect to the database.
     _connect()
-    # The project name.
+    # The report option measures the seed phases.
+    report_file = opts.get('report')
+    if report_file:
+        REPORT.measure_size = True
+        REPORT.reset()
+    # The project names.
     project = opts.get('project', DEFAULT_PROJECT)
+    projects = _project_names(project, opts.get('projects', 1))
+    # The cohort shape options.
+    seed_opts = dict(bulk=opts.get('bulk', False),
+                     jobs=opts.get('jobs', 1),
+                     random_seed=opts.get('random_seed'),
+                     subject_count=opts.get('subjects', SUBJECT_COUNT),
+                     visit_count=opts.get('visits'),
+                     volume_count=opts.get('volumes'))
+    # The snapshot and restore options only copy the database.
+    if 'snapshot' in opts:
+        count = snapshot(opts['snapshot'])
+        print("Saved %d documents to %s." % (count, opts['snapshot']))
+        return
+    if 'restore' in opts:
+        count = restore(opts['restore'])
+        print("Restored %d documents from %s." % (count, opts['restore']))
+        return
+    # The sweep flag only removes the orphaned session details.
+    if opts.get('sweep'):
+        count = sweep_orphans()
+        print("Removed %d orphaned session details." % count)
+        return
     # If the clinical flag is set, then only add clinical data.
     # Otherwise, create new subjects with imaging and clinical data.
-    if opts.get('clinical'):
-        mock_clinical(project)
+    for prj in projects:
+        if opts.get('clinical'):
+            mock_clinical(prj, random_seed=opts.get('random_seed'))
+        else:
+            # Consume the subjects without retaining them.
+            for _ in seed_subjects(prj, **seed_opts):
+                pass
+    if report_file:
+        _write_report(report_file, opts)
+
+
+def _write_report(path, opts):
+    """
+    Writes the :const:`REPORT` as JSON, together with the qirest
+    version and the seed command options.
+
+    :param path: the report file path, or ``-`` for standard output
+    :param opts: the seed command options
+    """
+    content = REPORT.as_dict()
+    content['version'] = qirest.__version__
+    content['options'] = {k: v for k, v in opts.iteritems() if k != 'report'}
+    text = json.dumps(content, indent=2)
+    if path == '-':
+        print(text)
     else:
-        seed(project)
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+
+
+def _project_names(project, count):
+    """
+    :param project: the base project name
+    :param count: the number of projects
+    :return: the *project* name if *count* is one, otherwise
+        *count* names *project*\ ``_1``, *project*\ ``_2``, ...
+    """
+    if count == 1:
+        return [project]
+    return ["%s_%d" % (project, i) for i in range(1, count + 1)]
 
 
 def _parse_arguments():
@@ -1063,6 +1879,35 @@ def _parse_arguments():
     env_grp.add_argument('--clinical', action='store_true',
                          help="Add mock clinical data to existing subjects")
     env_grp.add_argument('--project', help="the project to seed (default QIN_TEST)")
+    parser.add_argument('--snapshot', metavar='FILE',
+                        help="Save the database to a fixture file")
+    parser.add_argument('--restore', metavar='FILE',
+                        help="Replace the database with a fixture file")
+    parser.add_argument('--report', metavar='FILE',
+                        help="Write a JSON seed phase timing report to the"
+                             " file, or - for standard output")
+    parser.add_argument('--sweep', action='store_true',
+                        help="Remove the orphaned session details")
+    parser.add_argument('--bulk', action='store_true',
+                        help="Insert the new subjects in batches")
+    parser.add_argument('--subjects', type=_at_least(1), metavar='COUNT',
+                        help="the number of subjects per collection"
+                             " (default %d)" % SUBJECT_COUNT)
+    parser.add_argument('--visits', type=_at_least(MIN_VISIT_COUNT),
+                        metavar='COUNT',
+                        help="the number of visits per subject"
+                             " (default per collection)")
+    parser.add_argument('--volumes', type=_at_least(MIN_VOLUME_COUNT),
+                        metavar='COUNT',
+                        help="the number of volumes per scan"
+                             " (default per collection)")
+    parser.add_argument('--jobs', type=_at_least(1), metavar='COUNT',
+                        help="the number of subject generation processes"
+                             " (default 1)")
+    parser.add_argument('--random-seed', type=int, metavar='SEED',
+                        help="the integer seed of a reproducible database")
+    parser.add_argument('--projects', type=_at_least(1), metavar='COUNT',
+                        help="the number of projects to seed (default 1)")
 
     args = vars(parser.parse_args())
     nonempty_args = dict((k, v) for k, v in args.iteritems() if v != None)
@@ -1070,5 +1915,21 @@ def _parse_arguments():
     return nonempty_args
 
 
+def _at_least(minimum):
+    """
+    :param minimum: the minimum value
+    :return: the argparse type function which parses an integer
+        that is at least *minimum*
+    """
+    def parse(value):
+        number = int(value)
+        if number < minimum:
+            raise argparse.ArgumentTypeError("The value must be at least"
+                                             " %d: %s" % (minimum, value))
+        return number
+
+    return parse
+
+
 if __name__ == "__main__":
     sys.exit(main())
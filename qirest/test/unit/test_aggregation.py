@@ -0,0 +1,100 @@
+from nose.tools import (assert_equal, assert_almost_equal, assert_true)
+from bson import ObjectId
+from mongoengine import connect
+from qirest_client.model.subject import Subject
+from qirest.server import (aggregation, protocols)
+from qirest.test.helpers import seed
+
+
+class TestAggregation(object):
+    """
+    The modeling parameter summary unit tests.
+
+    Note: this test drops the ``qiprofile-test`` Mongo database
+    at the beginning and end of execution.
+    """
+    def setup(self):
+        self._connection = connect(db='qiprofile_test')
+        self._connection.drop_database('qiprofile_test')
+        protocols.REGISTRY.invalidate()
+        self._subjects = seed.seed(subject_count=2)
+
+    def tearDown(self):
+        self._connection.drop_database('qiprofile_test')
+
+    def test_summary(self):
+        summary = aggregation.modeling_summary(project=seed.DEFAULT_PROJECT)
+        # The expected {(collection, parameter): values} dictionary.
+        expected = {}
+        for sbj in self._subjects:
+            for sess in sbj.sessions:
+                for mdl in sess.modelings:
+                    for param in aggregation.MODELING_PARAMETERS:
+                        image = mdl.result[param].image
+                        value = image.metadata['average_intensity']
+                        key = (sbj.collection, param)
+                        expected.setdefault(key, []).append(value)
+        items = summary['collections']
+        assert_equal(len(items), len(expected),
+                     "The summary item count is incorrect: %d" % len(items))
+        for item in items:
+            values = sorted(expected[(item['collection'], item['parameter'])])
+            assert_equal(item['count'], len(values),
+                         "The %(collection)s %(parameter)s count is"
+                         " incorrect" % item)
+            assert_almost_equal(item['mean'], sum(values) / len(values))
+            assert_equal(item['min'], values[0])
+            assert_equal(item['max'], values[-1])
+            assert_equal(item['percentiles']['50'],
+                         values[(len(values) - 1) // 2])
+        for item in summary['sessions']:
+            assert_true(item['session'] > 0, "The session number is"
+                                             " missing")
+
+    def test_summary_values(self):
+        # Known k_trans averages of two sessions each in two subjects.
+        values = [[0.1, 0.4], [0.2, 0.3]]
+        subjects = [_raw_subject(number, averages)
+                    for number, averages in enumerate(values, start=100)]
+        Subject._get_collection().insert_many(subjects)
+        summary = aggregation.modeling_summary(project='QIN_Values')
+        items = [item for item in summary['collections']
+                 if item['parameter'] == 'fxl_k_trans']
+        assert_equal(len(items), 1, "The collection summary item count is"
+                                    " incorrect: %d" % len(items))
+        item = items[0]
+        assert_equal(item['collection'], 'Breast')
+        assert_equal(item['count'], 4)
+        assert_almost_equal(item['mean'], 0.25)
+        assert_equal(item['min'], 0.1)
+        assert_equal(item['max'], 0.4)
+        assert_equal(item['percentiles'],
+                     {'5': 0.1, '25': 0.1, '50': 0.2, '75': 0.3, '95': 0.3})
+        sessions = [item for item in summary['sessions']
+                    if item['parameter'] == 'fxl_k_trans']
+        actual = [(item['session'], item['min'], item['max'])
+                  for item in sessions]
+        assert_equal(actual, [(1, 0.1, 0.2), (2, 0.3, 0.4)],
+                     "The session summary is incorrect: %s" % actual)
+
+
+def _raw_subject(number, averages):
+    """
+    :param number: the subject number
+    :param averages: the session k_trans average intensities
+    :return: the raw subject document
+    """
+    sessions = []
+    for value in averages:
+        metadata = dict(average_intensity=value)
+        result = dict(fxl_k_trans=dict(image=dict(metadata=metadata)))
+        sessions.append(dict(_cls='Encounter.Session', detail=ObjectId(),
+                             modelings=[dict(result=result)]))
+
+    return dict(project='QIN_Values', collection='Breast', number=number,
+                encounters=sessions)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
@@ -0,0 +1,124 @@
+import json
+from urlparse import urlparse
+from nose.tools import (assert_equal, assert_raises, assert_is_none)
+from bson import ObjectId
+from flask import (Flask, request)
+from qirest.server import datalayer
+
+
+class TestDataLayer(object):
+    """The data layer keyset pagination unit tests."""
+
+    def test_cursor(self):
+        values = ['QIN_Test', 'Breast', 3, ObjectId()]
+        token = datalayer.encode_cursor(values)
+        assert_equal(datalayer.decode_cursor(token), values,
+                     "The cursor token does not round-trip")
+
+    def test_malformed_cursor(self):
+        with assert_raises(ValueError):
+            datalayer.decode_cursor('not a cursor')
+
+    def test_keyset_after(self):
+        keyset = ['project', 'collection', 'number']
+        actual = datalayer.keyset_after(keyset, ['QIN_Test', 'Breast', 3])
+        expected = {'$or': [
+            {'project': {'$gt': 'QIN_Test'}},
+            {'project': 'QIN_Test', 'collection': {'$gt': 'Breast'}},
+            {'project': 'QIN_Test', 'collection': 'Breast',
+             'number': {'$gt': 3}}
+        ]}
+        assert_equal(actual, expected, "The keyset condition is incorrect")
+
+    def test_page_count(self):
+        queryset = _QuerySet([dict(_id=i, number=i) for i in range(1, 8)])
+        page = datalayer.KeysetPage(queryset, ['number'], 3)
+        # Eve counts the page several times per request.
+        for _ in range(3):
+            assert_equal(page.count(), 3, "The page count is incorrect")
+        assert_equal([doc['number'] for doc in page], [1, 2, 3],
+                     "The page documents are incorrect")
+        assert_equal(queryset.queries, 1, "The page was fetched %d times" %
+                                          queryset.queries)
+        assert_equal(datalayer.decode_cursor(page.next), [3],
+                     "The next cursor is incorrect")
+
+    def test_last_page(self):
+        queryset = _QuerySet([dict(_id=i, number=i) for i in range(1, 3)])
+        page = datalayer.KeysetPage(queryset, ['number'], 3)
+        assert_equal(page.count(), 2, "The last page count is incorrect")
+        assert_is_none(page.next, "The last page has a next cursor")
+
+    def test_keyset_projection(self):
+        keyset = ['project', 'number']
+        include = datalayer._keyset_projection('{"birth_date": 1}', keyset)
+        assert_equal(json.loads(include),
+                     dict(birth_date=1, project=1, number=1),
+                     "The inclusion projection does not include the keys")
+        exclude = datalayer._keyset_projection('{"number": 0, "races": 0}',
+                                               keyset)
+        assert_equal(json.loads(exclude), dict(races=0),
+                     "The exclusion projection excludes a key")
+        assert_is_none(datalayer._keyset_projection('{"number": 0}', keyset),
+                       "The key-only exclusion projection was not removed")
+
+    def test_next_link(self):
+        app = Flask(__name__)
+        app.config.update(META='_meta', LINKS='_links')
+        where = '{"collection": "Breast"}'
+        projection = '{"birth_date": 1}'
+        url = '/subject?where=%s&projection=%s&max_results=2' % (where,
+                                                                 projection)
+        queryset = _QuerySet([dict(_id=i, number=i) for i in range(1, 8)])
+        page = datalayer.KeysetPage(queryset, ['number'], 2)
+        with app.test_request_context(url):
+            list(page)
+            response = {'_links': {'self': {'href': 'subject'}}}
+            page.extra(response)
+        href = urlparse(response['_links']['next']['href'])
+        assert_equal(href.path, 'subject', "The next link path is incorrect")
+        # Follow the next link.
+        with app.test_request_context('/subject?' + href.query):
+            assert_equal(request.args.get('where'), where,
+                         "The next link does not have the where filter")
+            assert_equal(request.args.get('projection'), projection,
+                         "The next link does not have the projection")
+            assert_equal(request.args.get('max_results'), '2',
+                         "The next link page size is incorrect")
+            cursor = request.args.get('cursor')
+            assert_equal(datalayer.parse_cursor(cursor, ['number']), [2],
+                         "The next link cursor is incorrect")
+            next_page = datalayer.KeysetPage(queryset, ['number'], 2)
+            list(next_page)
+            next_response = {'_links': {'self': {'href': 'subject'}}}
+            next_page.extra(next_response)
+        next_href = urlparse(next_response['_links']['next']['href'])
+        assert_equal(next_href.query.count('cursor='), 1,
+                     "The followed next link repeats the cursor")
+
+
+class _Document(object):
+    """A MongoEngine document stand-in."""
+
+    def __init__(self, son):
+        self._son = son
+
+    def to_mongo(self):
+        return self._son
+
+
+class _QuerySet(object):
+    """A MongoEngine query set stand-in which counts the queries."""
+
+    def __init__(self, sons):
+        self._sons = sons
+        self.queries = 0
+
+    def limit(self, n):
+        self.queries += 1
+        return [_Document(son) for son in self._sons[:n]]
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
@@ -0,0 +1,122 @@
+import json
+from nose.tools import (assert_equal, assert_not_in)
+from qirest_client.model.subject import Subject
+from qirest.server import (protocols, run)
+from qirest.test.helpers import seed
+
+SESSION_DATE = 'Fri, 01 Jan 2100 00:00:00 GMT'
+"""The appended session date, which follows the seed encounter dates."""
+
+EARLY_DATE = 'Mon, 01 Jan 1900 00:00:00 GMT'
+"""The inserted session date, which precedes the seed encounter dates."""
+
+
+class TestEncounters(object):
+    """
+    The subject encounter sub-resource unit tests.
+
+    Note: this test drops the ``qiprofile-test`` Mongo database
+    at the beginning and end of execution.
+    """
+    def setup(self):
+        self._db = Subject._get_db()
+        self._db.client.drop_database(self._db.name)
+        protocols.REGISTRY.invalidate()
+        self._subject = seed.seed(subject_count=1)[0]
+        self._client = run.app.test_client()
+        self._url = '/subject/%s/encounters' % self._subject.pk
+
+    def tearDown(self):
+        self._db.client.drop_database(self._db.name)
+
+    def test_append(self):
+        count = len(self._subject.encounters)
+        response = self._post(SESSION_DATE)
+        assert_equal(response.status_code, 201,
+                     "The append status code is incorrect: %d" %
+                     response.status_code)
+        encounters = self._raw_encounters()
+        assert_equal(len(encounters), count + 1,
+                     "The encounter count is incorrect: %d" % len(encounters))
+        assert_equal(encounters[-1]['date'].year, 2100,
+                     "The later encounter is not last")
+
+    def test_insert_in_date_order(self):
+        first = self._raw_encounters()[0]
+        response = self._post(EARLY_DATE)
+        assert_equal(response.status_code, 201,
+                     "The insert status code is incorrect: %d" %
+                     response.status_code)
+        encounters = self._raw_encounters()
+        assert_equal(encounters[0]['date'].year, 1900,
+                     "The earlier encounter is not first")
+        assert_equal(encounters[1], first,
+                     "The existing encounters were not shifted")
+
+    def test_patch(self):
+        encounter = self._subject.encounters[0]
+        date = encounter.date.strftime(run.app.config['DATE_FORMAT'])
+        patch = {'_cls': encounter._class_name, 'date': date, 'weight': 62}
+        # An earlier encounter shifts the patched encounter position.
+        self._post(EARLY_DATE)
+        response = self._patch(patch)
+        assert_equal(response.status_code, 200,
+                     "The patch status code is incorrect: %d" %
+                     response.status_code)
+        encounters = self._raw_encounters()
+        assert_equal(encounters[1]['weight'], 62,
+                     "The patched encounter weight is incorrect")
+        assert_not_in('weight', encounters[0],
+                      "The inserted encounter was patched")
+        # A mismatched encounter class is not patched.
+        other = 'Encounter.Biopsy'
+        if encounter._class_name == other:
+            other = 'Encounter.Session'
+        patch['_cls'] = other
+        response = self._patch(patch)
+        assert_equal(response.status_code, 404,
+                     "The mismatched patch status code is incorrect: %d" %
+                     response.status_code)
+
+    def test_events(self):
+        events = []
+        def pre_post(request):
+            events.append('pre_POST')
+        def update(updates, original):
+            # The encounter is not yet inserted.
+            count = len(self._raw_encounters())
+            events.append(('update', sorted(updates), count))
+        hooks = [(run.app.on_pre_POST_subject, pre_post),
+                 (run.app.on_update_subject, update)]
+        for event, hook in hooks:
+            event += hook
+        try:
+            count = len(self._raw_encounters())
+            self._post(SESSION_DATE)
+        finally:
+            for event, hook in hooks:
+                event -= hook
+        path = 'encounters.%d' % count
+        expected = ['pre_POST', ('update', sorted([path, '_updated']), count)]
+        assert_equal(events, expected, "The encounter events are incorrect:"
+                                       " %s" % events)
+
+    def _raw_encounters(self):
+        raw = Subject._get_collection().find_one({'_id': self._subject.pk})
+
+        return raw['encounters']
+
+    def _post(self, date):
+        session = {'_cls': 'Encounter.Session', 'date': date}
+
+        return self._client.post(self._url, data=json.dumps(session),
+                                 content_type='application/json')
+
+    def _patch(self, patch):
+        return self._client.patch(self._url, data=json.dumps(patch),
+                                  content_type='application/json')
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
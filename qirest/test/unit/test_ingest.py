@@ -0,0 +1,91 @@
+import json
+from nose.tools import (assert_equal, assert_in)
+from qirest_client.model.subject import Subject
+from qirest_client.model.imaging import SessionDetail
+from qirest.server import (indexes, run)
+
+SESSION_DATE = 'Tue, 01 Sep 2015 00:00:00 GMT'
+"""The test session date in the Eve date format."""
+
+
+class TestIngest(object):
+    """
+    The bulk subject ingest unit tests.
+
+    Note: this test drops the ``qiprofile-test`` Mongo database
+    at the beginning and end of execution.
+    """
+    def setup(self):
+        self._db = Subject._get_db()
+        self._db.client.drop_database(self._db.name)
+        indexes.create_indexes()
+        self._client = run.app.test_client()
+
+    def tearDown(self):
+        self._db.client.drop_database(self._db.name)
+
+    def test_ingest(self):
+        payload = [_subject(1), _subject(2), _subject(1),
+                   dict(project='QIN_Test', collection='Breast')]
+        response = self._client.post('/ingest', data=json.dumps(payload),
+                                     content_type='application/json')
+        assert_equal(response.status_code, 201,
+                     "The ingest status code is incorrect: %d" %
+                     response.status_code)
+        items = json.loads(response.data)['_items']
+        statuses = [item['_status'] for item in items]
+        assert_equal(statuses, ['OK', 'OK', 'ERR', 'ERR'],
+                     "The ingest item statuses are incorrect: %s" % statuses)
+        # The duplicate subject fails in the database.
+        assert_in('write', items[2]['_issues'])
+        # The session references the inserted session detail.
+        for item in items[:2]:
+            subject = Subject.objects.get(pk=item['_id'])
+            session = subject.encounters[0]
+            assert_equal(session.detail.scans, [],
+                         "%s session detail is incorrect" % subject)
+        # The failed subject session detail is removed.
+        count = SessionDetail.objects.count()
+        assert_equal(count, 2, "The session detail count is incorrect: %d" %
+                               count)
+
+    def test_events(self):
+        events = []
+        def pre_post(request):
+            events.append('pre_POST')
+        def insert_details(documents):
+            events.append(('insert details', len(documents)))
+        def insert_subjects(documents):
+            # The subjects are not yet inserted.
+            events.append(('insert subjects', Subject.objects.count()))
+        hooks = [(run.app.on_pre_POST_subject, pre_post),
+                 (run.app.on_insert_sessiondetail, insert_details),
+                 (run.app.on_insert_subject, insert_subjects)]
+        for event, hook in hooks:
+            event += hook
+        try:
+            payload = [_subject(1), _subject(2)]
+            self._client.post('/ingest', data=json.dumps(payload),
+                              content_type='application/json')
+        finally:
+            for event, hook in hooks:
+                event -= hook
+        expected = ['pre_POST', ('insert details', 2), ('insert subjects', 0)]
+        assert_equal(events, expected, "The ingest events are incorrect: %s" %
+                                       events)
+
+
+def _subject(number):
+    """
+    :param number: the subject number
+    :return: the subject payload with an inline session detail
+    """
+    session = {'_cls': 'Session', 'date': SESSION_DATE, 'detail': {}}
+
+    return dict(project='QIN_Test', collection='Breast', number=number,
+                encounters=[session])
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
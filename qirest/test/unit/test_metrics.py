@@ -0,0 +1,102 @@
+from nose.tools import (assert_equal, assert_in, assert_true)
+from qirest.server import (metrics, datalayer)
+
+RESOURCE = 'metricstest'
+"""The test resource label value."""
+
+
+class TestMetrics(object):
+    """The request metrics unit tests."""
+
+    def test_cursor_count(self):
+        cursor = metrics.CountedCursor(RESOURCE, _Cursor([dict(number=1)]))
+        before = _operations('count')
+        for _ in range(3):
+            cursor.count()
+        assert_equal(_operations('count') - before, 3,
+                     "The cursor count queries are not counted")
+
+    def test_keyset_page_count(self):
+        page = datalayer.KeysetPage(_Cursor([]), ['number'], 3)
+        cursor = metrics.CountedCursor(RESOURCE, page)
+        before = _operations('count')
+        cursor.count()
+        assert_equal(_operations('count'), before,
+                     "The keyset page count is counted as a query")
+
+    def test_document_bytes(self):
+        docs = [dict(number=1), dict(number=2)]
+        cursor = metrics.CountedCursor(RESOURCE, _Cursor(docs),
+                                       count_bytes=True)
+        before = _bytes(metrics.RECEIVED)
+        assert_equal(list(cursor), docs, "The cursor documents are incorrect")
+        # Each {'number': n} document is a 17 byte BSON document.
+        assert_equal(_bytes(metrics.RECEIVED) - before, 34,
+                     "The fetched document bytes are incorrect")
+        text = metrics.REGISTRY.format()
+        assert_in('qirest_mongo_document_bytes_total{resource="%s",'
+                  'direction="received"}' % RESOURCE, text,
+                  "The document bytes are not formatted")
+
+    def test_document_bytes_disabled(self):
+        docs = [dict(number=1), dict(number=2)]
+        cursor = metrics.CountedCursor(RESOURCE, _Cursor(docs))
+        before = _bytes(metrics.RECEIVED)
+        assert_equal(list(cursor), docs, "The cursor documents are incorrect")
+        assert_equal(_bytes(metrics.RECEIVED), before,
+                     "The document bytes are counted by default")
+
+    def test_streamed_size(self):
+        body = _Body(['{"number": 1}\n', u'{"name": "\u00e9"}\n'])
+        request = metrics.RequestMetrics()
+        measured = metrics.MeasuredBody(body, request)
+        assert_equal(''.join(measured), ''.join(body.chunks),
+                     "The streamed body is incorrect")
+        # The encoded accented character is two bytes.
+        assert_equal(request.size, 14 + 15,
+                     "The streamed size is incorrect")
+        measured.close()
+        assert_true(body.closed, "The streamed body is not closed")
+
+
+def _operations(operation):
+    return metrics.REGISTRY._operations.get((RESOURCE, operation), 0)
+
+
+def _bytes(direction):
+    return metrics.REGISTRY._bytes.get((RESOURCE, direction), 0)
+
+
+class _Cursor(object):
+    """A query set stand-in."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def limit(self, limit):
+        return _Cursor(self.docs[:limit])
+
+    def count(self, with_limit_and_skip=False):
+        return len(self.docs)
+
+
+class _Body(object):
+    """A streamed response body stand-in."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
@@ -0,0 +1,41 @@
+from nose.tools import (assert_equal, assert_is, assert_is_none)
+from mongoengine import connect
+from qirest.server.protocols import ProtocolRegistry
+
+REG_CONFIGURATION = {'Registration': dict(metric=['MI', 'CC'], sigma=1.5)}
+"""A test registration configuration."""
+
+
+class TestProtocols(object):
+    """
+    The protocol registry unit tests.
+
+    Note: this test drops the ``qiprofile-test`` Mongo database
+    at the beginning and end of execution.
+    """
+    def setup(self):
+        self._connection = connect(db='qiprofile_test')
+        self._connection.drop_database('qiprofile_test')
+        self._registry = ProtocolRegistry()
+
+    def tearDown(self):
+        self._connection.drop_database('qiprofile_test')
+
+    def test_get_or_create(self):
+        assert_is_none(self._registry.get('ANTs', REG_CONFIGURATION),
+                       "The protocol was found before it was created")
+        created = self._registry.get_or_create('ANTs', REG_CONFIGURATION)
+        cached = self._registry.get('ANTs', REG_CONFIGURATION)
+        assert_is(cached, created, "The protocol was not cached")
+
+    def test_invalidate(self):
+        created = self._registry.get_or_create('ANTs', REG_CONFIGURATION)
+        self._registry.invalidate()
+        loaded = self._registry.get('ANTs', REG_CONFIGURATION)
+        assert_equal(loaded.id, created.id, "The reloaded protocol is"
+                                            " incorrect")
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
@@ -0,0 +1,125 @@
+import io
+import json
+from nose.tools import (assert_equal, assert_is_none)
+from nose.plugins.skip import SkipTest
+from datetime import datetime
+from decimal import Decimal
+from bson import ObjectId
+import pytz
+from flask import Flask
+from eve.io.base import BaseJSONEncoder
+from qirest.server import (render, settings)
+
+DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+"""The Eve default RFC 1123 date format."""
+
+
+class TestRender(object):
+    """The renderer and MessagePack request unit tests."""
+
+    def test_to_native(self):
+        oid = ObjectId()
+        date = datetime(2013, 1, 4, tzinfo=pytz.utc)
+        value = dict(_id=oid, date=date, amount=Decimal('2.5'),
+                     encounters=[dict(detail=oid, weight=60)])
+        expected = dict(_id=str(oid), date='Fri, 04 Jan 2013 00:00:00 GMT',
+                        amount=2.5,
+                        encounters=[dict(detail=str(oid), weight=60)])
+        actual = render.to_native(value, DATE_FORMAT)
+        assert_equal(actual, expected, "The native conversion is incorrect")
+
+    def test_default_json_precision(self):
+        app = Flask(__name__)
+        app.config.update(JSON_RENDERER=settings.JSON_RENDERER)
+        app.data = _DataLayer()
+        render.register(app)
+        # Small and high-precision floats, e.g. modeling parameters.
+        values = [1e-17, 1.2345678901234567e-05, 0.21, 123456.78901234567]
+        with app.app_context():
+            rendered = render.json_renderer()(dict(values=values))
+        assert_equal(json.loads(rendered)['values'], values,
+                     "The default JSON renderer float round trip is"
+                     " incorrect")
+
+    def test_msgpack_round_trip(self):
+        if not render.msgpack:
+            raise SkipTest("msgpack is not installed")
+        oid = ObjectId()
+        value = dict(_id=oid, subject='Breast003', weights=[60, 62.5])
+        packed = render.render_msgpack(value)
+        actual = render._unpackb(packed)
+        expected = dict(_id=str(oid), subject='Breast003', weights=[60, 62.5])
+        assert_equal(actual, expected, "The MessagePack round trip is"
+                                       " incorrect")
+
+    def test_msgpack_request(self):
+        if not render.msgpack:
+            raise SkipTest("msgpack is not installed")
+        app = _App()
+        middleware = render.MsgpackRequestMiddleware(app)
+        content = dict(project='QIN_Test', number=3, weights=[60, 62.5])
+        status = _post(middleware, render.msgpack.packb(content))
+        assert_is_none(status, "The request was not passed to the"
+                               " application")
+        assert_equal(app.content_type, 'application/json',
+                     "The converted request content type is incorrect")
+        assert_equal(json.loads(app.body), content,
+                     "The converted request body is incorrect")
+
+    def test_msgpack_request_without_json_equivalent(self):
+        if not render.msgpack:
+            raise SkipTest("msgpack is not installed")
+        binary = render.msgpack.packb(dict(data=b'\xff\xfe'),
+                                      use_bin_type=True)
+        # A binary value is rejected even if it is valid UTF-8.
+        utf8 = render.msgpack.packb(dict(data=[b'text']), use_bin_type=True)
+        ext = render.msgpack.packb(dict(data=render.msgpack.ExtType(1, b'x')))
+        for body in [binary, utf8, ext, b'\xc1']:
+            app = _App()
+            status = _post(render.MsgpackRequestMiddleware(app), body)
+            assert_equal(status, '400 BAD REQUEST',
+                         "The unconvertible request status is incorrect")
+            assert_is_none(app.body, "The unconvertible request was passed"
+                                     " to the application")
+
+
+class _DataLayer(object):
+    """An Eve data layer stand-in."""
+
+    json_encoder_class = BaseJSONEncoder
+
+
+class _App(object):
+    """A WSGI application stand-in which records the request body."""
+
+    def __init__(self):
+        self.content_type = None
+        self.body = None
+
+    def __call__(self, environ, start_response):
+        self.content_type = environ['CONTENT_TYPE']
+        length = int(environ['CONTENT_LENGTH'])
+        self.body = environ['wsgi.input'].read(length).decode('utf-8')
+        return []
+
+
+def _post(wsgi_app, body):
+    """
+    :param wsgi_app: the WSGI application
+    :param body: the MessagePack request body
+    :return: the response status, or None if the application was
+        called
+    """
+    environ = {'REQUEST_METHOD': 'POST',
+               'CONTENT_TYPE': render.MSGPACK_MIMETYPE,
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': io.BytesIO(body)}
+    statuses = []
+    wsgi_app(environ, lambda status, headers: statuses.append(status))
+
+    return statuses[0] if statuses else None
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
@@ -0,0 +1,29 @@
+import time
+from nose.tools import (assert_equal, assert_true)
+from qirest.test.helpers.report import PhaseReport
+
+
+class TestReport(object):
+    """The seed phase report unit tests."""
+
+    def test_nested_phases(self):
+        report = PhaseReport()
+        with report.phase('outer'):
+            with report.phase('inner'):
+                time.sleep(0.05)
+                report.record('inner', documents=10, round_trips=1)
+        phases = {item['phase']: item for item in report.as_dict()['phases']}
+        assert_equal(set(phases), set(['outer', 'inner']),
+                     "The phases are incorrect: %s" % phases.keys())
+        inner = phases['inner']
+        assert_equal(inner['documents'], 10, "The document count is"
+                                             " incorrect")
+        assert_equal(inner['round_trips'], 1, "The round trip count is"
+                                              " incorrect")
+        assert_true(phases['outer']['seconds'] < inner['seconds'],
+                    "The inner phase time is counted in the outer phase")
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
@@ -1,11 +1,16 @@
 from nose.tools import (assert_is_none, assert_is_instance, assert_in,
                         assert_is_not_none, assert_true, assert_false,
                         assert_equal)
+import os
+import shutil
+import tempfile
 from datetime import datetime
 from mongoengine import connect
 from qirest_client.model.subject import Subject
+from qirest_client.model.imaging import SessionDetail
 from qirest_client.model.uom import Weight
 from qirest_client.model.clinical import (Biopsy, Surgery, Drug)
+from qirest.server import protocols
 from qirest.test.helpers import seed
 
 MODELING_RESULT_PARAMS = ['fxl_k_trans', 'fxr_k_trans', 'delta_k_trans', 'v_e', 'tau_i']
@@ -18,11 +23,30 @@ class TestSeed(object):
 
     Note: this test drops the ``qiprofile-test`` Mongo database
     at the beginning and end of execution.
+
+    The database is seeded once. Each test starts from a restored
+    snapshot of the seeded database.
     """
+    @classmethod
+    def setup_class(cls):
+        connection = connect(db='qiprofile_test')
+        connection.drop_database('qiprofile_test')
+        # The dropped protocols are no longer valid.
+        protocols.REGISTRY.invalidate()
+        seed.seed()
+        cls._fixture_dir = tempfile.mkdtemp()
+        cls._fixture = os.path.join(cls._fixture_dir, 'seed.bson.gz')
+        seed.snapshot(cls._fixture)
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls._fixture_dir)
+
     def setup(self):
         self._connection = connect(db='qiprofile_test')
         self._connection.drop_database('qiprofile_test')
-        self._subjects = seed.seed()
+        seed.restore(self._fixture)
+        self._subjects = list(Subject.objects(project=seed.DEFAULT_PROJECT))
 
     def tearDown(self):
         self._connection.drop_database('qiprofile_test')
@@ -48,6 +72,123 @@ class TestSeed(object):
                                        "\nexpected:\n%s\nfound:\n%s" %
                                        (expected, actual))
 
+    def test_mock_clinical(self):
+        seed.mock_clinical(seed.DEFAULT_PROJECT)
+        for saved_sbj in self._subjects:
+            fetched_sbj = Subject.objects.get(id=saved_sbj.id)
+            self._validate_subject(fetched_sbj)
+            sessions = list(fetched_sbj.sessions)
+            assert_equal(sessions, list(saved_sbj.sessions),
+                         "%s sessions were changed" % fetched_sbj)
+
+    def test_clear(self):
+        # A subject beyond the seeded cohort is also cleared.
+        extra = dict(project=seed.DEFAULT_PROJECT, collection='Sarcoma',
+                     number=seed.SUBJECT_COUNT + 1000)
+        Subject._get_collection().insert_one(extra)
+        seed.clear(seed.DEFAULT_PROJECT)
+        assert_equal(Subject.objects.count(), 0,
+                     "The subjects were not cleared")
+        assert_equal(SessionDetail.objects.count(), 0,
+                     "The session details were not cleared")
+
+    def test_clear_round_trips(self):
+        detail_cnt = SessionDetail.objects.count()
+        seed.REPORT.reset()
+        seed.clear(seed.DEFAULT_PROJECT)
+        phase = seed.REPORT.as_dict()['phases'][0]
+        # One subject scan batch, the detail delete batches and three
+        # deletes.
+        batch_cnt = -(-detail_cnt // seed.BULK_BATCH_SIZE)
+        assert_equal(phase['round_trips'], 1 + batch_cnt + 3,
+                     "The clear round trip count is incorrect: %d" %
+                     phase['round_trips'])
+
+    def test_sweep_orphans(self):
+        orphan = SessionDetail()
+        orphan.save()
+        count = seed.sweep_orphans()
+        assert_equal(count, 1, "The orphan sweep count is incorrect: %d" %
+                               count)
+        assert_equal(SessionDetail.objects(id=orphan.id).count(), 0,
+                     "The orphan was not removed")
+        for subject in self._subjects:
+            for sess in Subject.objects.get(id=subject.id).sessions:
+                assert_is_not_none(sess.detail, "%s session detail was"
+                                                " removed" % subject)
+
+    def test_bulk_seed(self):
+        self._connection.drop_database('qiprofile_test')
+        subjects = seed.seed(bulk=True)
+        expected = set(str(sbj) for sbj in self._subjects)
+        actual = set(str(sbj) for sbj in subjects)
+        assert_equal(actual, expected, "Bulk seed result is incorrect -"
+                                       "\nexpected:\n%s\nfound:\n%s" %
+                                       (expected, actual))
+        for saved_sbj in subjects:
+            fetched_sbj = Subject.objects.get(id=saved_sbj.id)
+            self._validate_subject(fetched_sbj)
+
+    def test_seed_subjects(self):
+        count = 0
+        for subject in seed.seed_subjects(subject_count=3, bulk=True):
+            assert_is_not_none(subject.id, "%s is not saved when yielded" %
+                                           subject)
+            count += 1
+        assert_equal(count, 3 * len(seed.COLLECTION_BUILDERS),
+                     "Subject count is incorrect: %d" % count)
+
+    def test_cohort_shape(self):
+        subjects = seed.seed(subject_count=2, visit_count=5, volume_count=10)
+        assert_equal(len(subjects), 2 * len(seed.COLLECTION_BUILDERS),
+                     "Subject count is incorrect: %d" % len(subjects))
+        for subject in subjects:
+            sessions = list(subject.sessions)
+            assert_equal(len(sessions), 5, "%s session count is incorrect: %d" %
+                                           (subject, len(sessions)))
+            for session in sessions:
+                images = session.detail.scans[0].volumes.images
+                assert_equal(len(images), 10,
+                             "%s volume count is incorrect: %d" %
+                             (subject, len(images)))
+
+    def test_parallel_seed(self):
+        subjects = seed.seed(subject_count=3, jobs=2)
+        assert_equal(len(subjects), 3 * len(seed.COLLECTION_BUILDERS),
+                     "Subject count is incorrect: %d" % len(subjects))
+        for saved_sbj in subjects:
+            fetched_sbj = Subject.objects.get(id=saved_sbj.id)
+            self._validate_subject(fetched_sbj)
+
+    def test_parallel_content(self):
+        serial = self._reseed(subject_count=3, random_seed=7)
+        parallel = self._reseed(subject_count=3, random_seed=7, jobs=2)
+        assert_equal(parallel, serial, "The parallel seed content differs"
+                                       " from the serial seed content")
+
+    def test_random_seed(self):
+        first = self._reseed(subject_count=2, random_seed=7)
+        second = self._reseed(subject_count=2, random_seed=7)
+        assert_equal(second, first, "The seeded content is not reproducible")
+
+    def _reseed(self, **opts):
+        """
+        Seeds an empty database, so that the protocols are created
+        by the seed as well.
+
+        :param opts: the :meth:`seed` options
+        :return: the {collection name: raw documents} dictionary
+        """
+        self._connection.drop_database('qiprofile_test')
+        protocols.REGISTRY.invalidate()
+        seed.seed(**opts)
+        content = {}
+        for klass in seed.SNAPSHOT_MODELS:
+            collection = klass._get_collection()
+            content[collection.name] = list(collection.find(sort=[('_id', 1)]))
+
+        return content
+
     def _validate_subject(self, subject):
         collections = ((coll.name for coll in seed.COLLECTION_BUILDERS))
         assert_in(subject.collection, collections,
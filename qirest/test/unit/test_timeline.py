@@ -0,0 +1,83 @@
+from nose.tools import (assert_equal, assert_is_none)
+from mongoengine import connect
+from qirest_client.model.subject import Subject
+from qirest.server import (timeline, protocols, indexes)
+from qirest.test.helpers import seed
+
+
+class TestTimeline(object):
+    """
+    The subject timeline unit tests.
+
+    Note: this test drops the ``qiprofile-test`` Mongo database
+    at the beginning and end of execution.
+    """
+    def setup(self):
+        self._connection = connect(db='qiprofile_test')
+        self._connection.drop_database('qiprofile_test')
+        protocols.REGISTRY.invalidate()
+        self._subjects = seed.seed(subject_count=2)
+
+    def tearDown(self):
+        self._connection.drop_database('qiprofile_test')
+
+    def test_rebuild(self):
+        count = timeline.rebuild()
+        assert_equal(count, len(self._subjects),
+                     "The rebuilt timeline count is incorrect: %d" % count)
+        collection = timeline.Timeline._get_collection()
+        for sbj in self._subjects:
+            doc = collection.find_one({'_id': sbj.pk})
+            sessions = doc['sessions']
+            assert_equal(len(sessions), len(sbj.sessions),
+                         "%s timeline session count is incorrect: %d" %
+                         (sbj, len(sessions)))
+            for item, sess in zip(sessions, sbj.sessions):
+                # The database date is naive UTC.
+                date = sess.date.replace(tzinfo=None)
+                assert_equal(item['date'], date,
+                             "%s timeline session date is incorrect" % sbj)
+                assert_equal(len(item['modelings']), len(sess.modelings),
+                             "%s timeline modeling count is incorrect" % sbj)
+                for averages, mdl in zip(item['modelings'], sess.modelings):
+                    for param in timeline.MODELING_PARAMETERS:
+                        image = mdl.result[param].image
+                        expected = image.metadata['average_intensity']
+                        assert_equal(averages[param], expected,
+                                     "%s timeline %s average is incorrect" %
+                                     (sbj, param))
+
+    def test_refresh(self):
+        timeline.rebuild()
+        deleted = self._subjects[0]
+        Subject._get_collection().delete_one({'_id': deleted.pk})
+        timeline.refresh([deleted.pk])
+        collection = timeline.Timeline._get_collection()
+        assert_is_none(collection.find_one({'_id': deleted.pk}),
+                       "The deleted %s timeline was not removed" % deleted)
+        assert_equal(collection.count(), len(self._subjects) - 1,
+                     "The refreshed timeline count is incorrect")
+
+    def test_rebuild_swapped_keys(self):
+        indexes.create_indexes()
+        timeline.rebuild()
+        first, second = self._subjects
+        # Swap the subject numbers in the database.
+        collection = Subject._get_collection()
+        collection.update_one({'_id': first.pk}, {'$set': {'number': -1}})
+        collection.update_one({'_id': second.pk},
+                              {'$set': {'number': first.number}})
+        collection.update_one({'_id': first.pk},
+                              {'$set': {'number': second.number}})
+        timeline.rebuild()
+        timelines = timeline.Timeline._get_collection()
+        for sbj, number in [(first, second.number), (second, first.number)]:
+            doc = timelines.find_one({'_id': sbj.pk})
+            assert_equal(doc['number'], number,
+                         "%s swapped timeline number is incorrect: %d" %
+                         (sbj, doc['number']))
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)
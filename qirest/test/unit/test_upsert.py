@@ -0,0 +1,141 @@
+import json
+from collections import OrderedDict
+from nose.tools import (assert_equal, assert_not_in, assert_raises)
+from bson import SON
+from qirest_client.model.subject import Subject
+from qirest_client.model.imaging import Protocol
+from qirest.server import (indexes, run, upsert)
+
+PROTOCOL_KEY = upsert.NATURAL_KEYS['protocol']
+"""The protocol natural key fields."""
+
+
+class TestUpsert(object):
+    """
+    The natural key upsert unit tests.
+
+    Note: this test drops the ``qiprofile-test`` Mongo database
+    at the beginning and end of execution.
+    """
+    def setup(self):
+        self._db = Subject._get_db()
+        self._db.client.drop_database(self._db.name)
+        indexes.create_indexes()
+        self._client = run.app.test_client()
+
+    def tearDown(self):
+        self._db.client.drop_database(self._db.name)
+
+    def test_get_or_insert(self):
+        config = OrderedDict([('sigma', 1.5), ('metric', 'MI')])
+        created = upsert.get_or_insert(
+            Protocol, dict(technique='ANTs', configuration=config),
+            PROTOCOL_KEY
+        )
+        # The configuration item order does not matter.
+        reordered = OrderedDict(reversed(config.items()))
+        fetched = upsert.get_or_insert(
+            Protocol, dict(technique='ANTs', configuration=reordered),
+            PROTOCOL_KEY
+        )
+        assert_equal(fetched.id, created.id, "The protocol was inserted"
+                                             " twice")
+        # A protocol without a configuration is a different protocol.
+        plain = upsert.get_or_insert(Protocol, dict(technique='ANTs'),
+                                     PROTOCOL_KEY)
+        count = Protocol.objects.count()
+        assert_equal(count, 2, "The protocol count is incorrect: %d" % count)
+        assert_equal(plain.technique, 'ANTs',
+                     "The protocol technique is incorrect")
+
+    def test_index_migration(self):
+        collection = self._legacy_protocols()
+        reordered = SON([('sigma', 1.5), ('metric', 'MI')])
+        legacy_id = collection.insert_one(
+            dict(technique='ANTs', configuration=reordered)
+        ).inserted_id
+        indexes.create_indexes()
+        assert_equal(indexes.missing_indexes(), [],
+                     "The unique protocol index was not created")
+        # The legacy item order is rewritten, so the protocol matches.
+        config = dict(metric='MI', sigma=1.5)
+        fetched = upsert.get_or_insert(
+            Protocol, dict(technique='ANTs', configuration=config),
+            PROTOCOL_KEY
+        )
+        assert_equal(fetched.id, legacy_id, "The legacy protocol was not"
+                                            " matched")
+
+    def test_index_migration_duplicates(self):
+        collection = self._legacy_protocols()
+        for items in [[('sigma', 1.5), ('metric', 'MI')],
+                      [('metric', 'MI'), ('sigma', 1.5)]]:
+            collection.insert_one(dict(technique='ANTs',
+                                       configuration=SON(items)))
+        with assert_raises(indexes.UniqueIndexError):
+            indexes.create_indexes()
+        # The non-unique index is kept.
+        keys = [idx['key'] for idx in collection.index_information().values()]
+        assert_equal(len(keys), 2, "The legacy protocol index was dropped")
+
+    def test_upsert_subject(self):
+        subject = dict(project='QIN_Test', collection='Breast', number=1,
+                       races=['White'])
+        response = self._put(subject)
+        assert_equal(response.status_code, 201,
+                     "The insert status code is incorrect: %d" %
+                     response.status_code)
+        inserted_id = json.loads(response.data)['_id']
+        del subject['races']
+        response = self._put(subject)
+        assert_equal(response.status_code, 200,
+                     "The replace status code is incorrect: %d" %
+                     response.status_code)
+        assert_equal(json.loads(response.data)['_id'], inserted_id,
+                     "The replaced subject id is incorrect")
+        raw = Subject._get_collection().find_one()
+        assert_not_in('races', raw, "The replaced subject field was not"
+                                   " removed")
+        count = Subject.objects.count()
+        assert_equal(count, 1, "The subject count is incorrect: %d" % count)
+
+    def test_pre_put_event(self):
+        lookups = []
+        def pre_put(request, lookup):
+            # The subject is not yet written.
+            lookups.append((lookup, Subject.objects.count()))
+        event = run.app.on_pre_PUT_subject
+        event += pre_put
+        try:
+            self._put(dict(project='QIN_Test', collection='Breast', number=1))
+        finally:
+            event -= pre_put
+        assert_equal(lookups, [({}, 0)],
+                     "The pre-PUT event is incorrect: %s" % lookups)
+
+    def test_unknown_resource(self):
+        response = self._client.put('/upsert/project', data='{}',
+                                    content_type='application/json')
+        assert_equal(response.status_code, 404,
+                     "The unknown resource status code is incorrect: %d" %
+                     response.status_code)
+
+    def _legacy_protocols(self):
+        """
+        :return: the protocol collection with the non-unique
+            natural key index of an earlier release
+        """
+        collection = Protocol._get_collection()
+        collection.drop_indexes()
+        collection.create_index([('technique', 1), ('configuration', 1)])
+
+        return collection
+
+    def _put(self, subject):
+        return self._client.put('/upsert/subject', data=json.dumps(subject),
+                                content_type='application/json')
+
+
+if __name__ == "__main__":
+    import nose
+    nose.main(defaultTest=__name__)